@@ -1,199 +1,81 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import sys
 import json
 from pathlib import Path
-import sqlite3
-
-DB_PATH = 'matches.db'
+import db
+import match_snapshot
+import player_totals
+import stats_engine
+
+DB_PATH = db.DB_PATH
+# players.id of a name; used inline so SQLite can seek the (player, match_date) indexes
+PLAYER_ID = "(SELECT id FROM players WHERE name = :player)"
+
+# a player's matches from their own side, named like enrich_dataframe's output
+PLAYER_MATCHES = """
+    SELECT match_id AS id, match_date, self_name AS player, opp_name,
+           self_rating AS floris_rating, opp_rating,
+           set1_self AS set1_floris, set1_opp, set2_self AS set2_floris, set2_opp,
+           set3_self AS set3_floris, set3_opp,
+           won, set3_self IS NOT NULL AS is_3set
+      FROM player_matches
+"""
+
+# the compact dtypes of a player frame: ratings in float32, opponent names as a
+# category, set scores as nullable Int8 (an unplayed set is <NA>, not NaN)
+PLAYER_DTYPES = {
+    "floris_rating": "float32", "opp_rating": "float32", "opp_name": "category",
+    **{f"set{i}_{side}": "Int8" for i in (1, 2, 3) for side in ("floris", "opp")},
+}
+
+def compact(df: pd.DataFrame) -> pd.DataFrame:
+    """A player frame (from SQL or the snapshot) in PLAYER_DTYPES."""
+    return df.astype(PLAYER_DTYPES)
 
 def load_matches(db_path: str, player: str) -> pd.DataFrame:
-    conn = sqlite3.connect(db_path)
+    conn = db.get_connection(db_path)
+    if match_snapshot.is_fresh(conn, db_path):
+        return compact(match_snapshot.load_player_matches(db_path, conn, player))
     df = pd.read_sql_query(
-        "SELECT * FROM matches WHERE player1 = :player OR player2 = :player",
-        conn, params={"player": player}, parse_dates=["match_date"]
+        f"{PLAYER_MATCHES} WHERE player_id = {PLAYER_ID} ORDER BY match_date",
+        conn, params={"player": player}, parse_dates=["match_date"],
+        dtype={"won": bool, "is_3set": bool}
     )
-    conn.close()
-    return df
+    return compact(df)
 
 def enrich_dataframe(df: pd.DataFrame, player: str) -> pd.DataFrame:
     df = df.copy()
-    df["is_p1"] = df["player1"] == player
+    is_p1 = (df["player1"] == player).to_numpy()
+    df["is_p1"] = is_p1
+
+    def side(own, other):
+        # whole columns swapped on the is_p1 mask instead of row by row
+        return np.where(is_p1, df[own].to_numpy(), df[other].to_numpy())
+
     # Floris’s rating
-    df["floris_rating"] = df.apply(lambda r: r["rating1"] if r["is_p1"] else r["rating2"], axis=1)
+    df["floris_rating"] = side("rating1", "rating2")
     # Opponent name & rating
-    df["opp_name"]   = df.apply(lambda r: r["player2"] if r["is_p1"] else r["player1"], axis=1)
-    df["opp_rating"] = df.apply(lambda r: r["rating2"] if r["is_p1"] else r["rating1"], axis=1)
+    df["opp_name"]   = side("player2", "player1")
+    df["opp_rating"] = side("rating2", "rating1")
     # Per-set scores
     for i in (1,2,3):
-        df[f"set{i}_floris"] = df.apply(
-            lambda r: r[f"set{i}_p1"] if r["is_p1"] else r[f"set{i}_p2"], axis=1
-        )
-        df[f"set{i}_opp"] = df.apply(
-            lambda r: r[f"set{i}_p2"] if r["is_p1"] else r[f"set{i}_p1"], axis=1
-        )
+        df[f"set{i}_floris"] = side(f"set{i}_p1", f"set{i}_p2")
+        df[f"set{i}_opp"]    = side(f"set{i}_p2", f"set{i}_p1")
+    df = df.astype(PLAYER_DTYPES)
     # Win flag
-    df["won"] = df["winner"] == player
+    df["won"] = (df["winner"] == player).to_numpy()
     # 3-set flag
     df["is_3set"] = df["set3_floris"].notna()
     return df
 
-def compute_statistics(df: pd.DataFrame) -> dict:
-    stats = {}
-    n = len(df)
-
-    # 1) Matches won/lost
-    stats["won"] = df["won"].sum()
-    stats["lost"] = n - stats["won"]
-
-    # 2) Won/lost in 3 sets
-    stats["won_3"]  = df[df["won"]  & df["is_3set"]].shape[0]
-    stats["lost_3"] = df[~df["won"] & df["is_3set"]].shape[0]
-
-    # 3) Longest win-streak (unchanged)
-    def longest_streak(series):
-        max_s = cur = 0
-        for x in series:
-            cur = cur+1 if x else 0
-            max_s = max(max_s, cur)
-        return max_s
-    stats["longest_streak"] = longest_streak(df.sort_values("match_date")["won"])
-
-    # 4) Tiebreaks won/lost (unchanged)
-    tbw = tbl = 0
-    for i in (1,2,3):
-        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
-        tb = ((sf==7)&(so==6))|((sf==6)&(so==7))
-        tbw += int(((sf>so)& tb).sum())
-        tbl += int(((so>sf)& tb).sum())
-    stats["tb_won"], stats["tb_lost"] = tbw, tbl
-
-    # 5) Comeback rate (down 0–1 → win)
-    dropped1 = df[df["set1_floris"] < df["set1_opp"]]
-    stats["comebacks"] = dropped1["won"].sum()
-    stats["comeback_rate"] = (
-        stats["comebacks"] / len(dropped1)
-        if len(dropped1)>0 else 0.0
-    )
-
-    # A) Set-win percentage
-    total_sets = 0
-    sets_won   = 0
-    for i in (1,2,3):
-        sf = df[f"set{i}_floris"]
-        so = df[f"set{i}_opp"]
-        played = sf.notna() & so.notna()
-        total_sets += int(played.sum())
-        sets_won   += int(((sf>so)& played).sum())
-    stats["set_win_pct"] = sets_won / total_sets if total_sets else 0.0
-
-    # B) Games-won percentage
-    gf = go = 0
-    for i in (1,2,3):
-        sf = df[f"set{i}_floris"].fillna(0)
-        so = df[f"set{i}_opp"].fillna(0)
-        gf += sf.sum()
-        go += so.sum()
-    stats["game_win_pct"] = gf / (gf+go) if (gf+go)>0 else 0.0
-
-    # C) Performance vs higher-rated opponents
-    upsets = df[df["opp_rating"] < df["floris_rating"]]
-    favours = df[df["opp_rating"] >= df["floris_rating"]]
-    stats["upset_win_pct"] = (
-        upsets["won"].sum() / len(upsets)
-        if len(upsets)>0 else None
-    )
-    stats["favoured_win_pct"] = (
-        favours["won"].sum() / len(favours)
-        if len(favours)>0 else None
-    )
-
-    # D) Straight-sets vs 3-sets ratio (of wins)
-    wins = df[df["won"]]
-    straight = wins[~wins["is_3set"]].shape[0]
-    three    = wins[wins["is_3set"]].shape[0]
-    stats["straight_vs_3_ratio"] = (straight, three)
-
-    # E) Close-set outcomes (7-5 / 5-7)
-    csw = csl = 0
-    for i in (1,2,3):
-        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
-        mask75 = (sf==7)&(so==5)
-        mask57 = (sf==5)&(so==7)
-        csw += int(mask75.sum())
-        csl += int(mask57.sum())
-    stats["close_set_won"], stats["close_set_lost"] = csw, csl
-
-    # F) Bagels (6-0) & Breadsticks (6-1)
-    bagels_won = bread_won = bagels_lost = bread_lost = 0
-    for i in (1,2,3):
-        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
-        played = sf.notna() & so.notna()
-        bagels_won  += int(((sf==6)&(so==0)& played).sum())
-        bread_won   += int(((sf==6)&(so==1)& played).sum())
-        bagels_lost += int(((so==6)&(sf==0)& played).sum())
-        bread_lost  += int(((so==6)&(sf==1)& played).sum())
-    stats["bagels_won"]  = bagels_won
-    stats["bread_won"]   = bread_won
-    stats["bagels_lost"] = bagels_lost
-    stats["bread_lost"]  = bread_lost
-
-    # G) Best/Worst & averages (unchanged from before)
-    beaten = df[df["won"]]
-    lostto = df[~df["won"]]
-
-    if not beaten.empty:
-        bb_row = beaten.loc[beaten["opp_rating"].idxmin()]
-        stats["best_beaten"] = {
-            "opponent": bb_row["opp_name"],
-            "rating": bb_row["opp_rating"]
-        }
-        stats["avg_rating_beaten"] = beaten["opp_rating"].mean()
-
-    if not lostto.empty:
-        wl_row = lostto.loc[lostto["opp_rating"].idxmax()]
-        stats["worst_lost_to"] = {
-            "opponent": wl_row["opp_name"],
-            "rating": wl_row["opp_rating"]
-        }
-        stats["avg_rating_lostto"] = lostto["opp_rating"].mean()
-
-    for i in (1, 2, 3):
-        sf = df[f"set{i}_floris"]
-        so = df[f"set{i}_opp"]
-        played = sf.notna() & so.notna()
-        wins = ((sf > so) & played).sum()
-        total = played.sum()
-        stats[f"set{i}_win_pct"] = wins / total if total else None
-
-        # Biggest upset win
-    wins_df = df[df["won"]].copy()  # <-- copy() here
-    wins_df["rating_diff"] = wins_df["floris_rating"] - wins_df["opp_rating"]
-    upsets = wins_df[wins_df["rating_diff"] > 0]
-    if not upsets.empty:
-        uw = upsets.loc[upsets["rating_diff"].idxmax()]
-        stats["biggest_upset_win"] = {
-            "opponent": uw["opp_name"],
-            "rating_diff": uw["rating_diff"]
-        }
-    else:
-        stats["biggest_upset_win"] = None
-
-    # Biggest bad-beat loss
-    losses_df = df[~df["won"]].copy()  # <-- and copy() here
-    losses_df["rating_diff"] = losses_df["opp_rating"] - losses_df["floris_rating"]
-    bad_beats = losses_df[losses_df["rating_diff"] > 0]
-    if not bad_beats.empty:
-        bb = bad_beats.loc[bad_beats["rating_diff"].idxmax()]
-        stats["biggest_bad_beat_loss"] = {
-            "opponent": bb["opp_name"],
-            "rating_diff": bb["rating_diff"]
-        }
-    else:
-        stats["biggest_bad_beat_loss"] = None
-
-
-    return stats
+def compute_statistics(df: pd.DataFrame, metrics=None) -> dict:
+    """
+        The report statistics of a player frame, or only `metrics` (names from
+        stats_engine.METRICS); see stats_engine for how each is computed.
+    """
+    return stats_engine.compute(df, metrics)
 
 
 def generate_rating_plot_html(player_name, output_path="rating_plot.html"):
@@ -217,28 +99,22 @@ def generate_rating_plot_html(player_name, output_path="rating_plot.html"):
 
 
     # --- 1) Load all historical ratings from matches table ---
-    conn = sqlite3.connect('matches.db')
+    conn = db.get_connection(DB_PATH)
     cursor = conn.cursor()
-    cursor.execute("""
-            SELECT 
-              match_date,
-              CASE 
-                WHEN player1 = ? THEN rating1 
-                ELSE rating2 
-              END AS rating
-            FROM matches
-            WHERE player1 = ? OR player2 = ?
-        """, (player_name, player_name, player_name))
+    cursor.execute(f"""
+            SELECT match_date, self_rating AS rating
+            FROM player_matches
+            WHERE player_id = {PLAYER_ID}
+        """, {"player": player_name})
     match_rows = cursor.fetchall()
 
     # --- 2) Load current ratings ---
-    cursor.execute("""
+    cursor.execute(f"""
             SELECT date, rating
             FROM current_ratings
-            WHERE name = ?
-        """, (player_name,))
+            WHERE player_id = {PLAYER_ID}
+        """, {"player": player_name})
     current_rows = cursor.fetchall()
-    conn.close()
 
     # --- 3) Combine & normalize into list of dicts ---
     data = []
@@ -342,12 +218,14 @@ def generate_rating_plot_html(player_name, output_path="rating_plot.html"):
 
 def analyze(PLAYER):
     df    = load_matches(DB_PATH, PLAYER)
-    df    = enrich_dataframe(df, PLAYER)
-    stats = compute_statistics(df)
+    # headline counts straight from the running totals, kept up to date on insert;
+    # the engine only computes what they do not cover
+    stats = player_totals.headline(db.get_connection(DB_PATH), PLAYER) or {}
+    stats.update(compute_statistics(df, [m for m in stats_engine.METRICS if m not in stats]))
 
     lines = []
     lines.append(f"=== Statistics for {PLAYER} ===")
-    lines.append(f"Matches played:   {len(df)}")
+    lines.append(f"Matches played:   {stats.get('matches', len(df))}")
     # 1) Overall W/L %
     w, l = stats['won'], stats['lost']
     pct = w / (w + l) if (w + l) > 0 else 0
@@ -0,0 +1,196 @@
+import argparse
+import queue
+import threading
+import time
+from pathlib import Path
+
+from selenium.webdriver.support.ui import WebDriverWait
+
+import db
+import match_snapshot
+import player_rating_progression_scrape as scrape
+from page_archive import PageArchive
+import scrape_metrics
+from scrape_metrics import ScrapeMetrics
+from scrape_pipeline import PagePipeline
+
+DB_PATH = db.DB_PATH
+
+
+def read_member_numbers(source) -> list:
+    """
+        Accepts a list of member numbers or a path to a text file with one
+        member number per line (blank lines and '#' comments are ignored).
+    """
+    if isinstance(source, (str, Path)):
+        lines = Path(source).read_text(encoding="utf-8").splitlines()
+    else:
+        lines = source
+
+    numbers = []
+    seen = set()
+    for line in lines:
+        nr = str(line).split('#', 1)[0].strip()
+        if nr and nr not in seen:
+            seen.add(nr)
+            numbers.append(nr)
+    return numbers
+
+
+class RateLimiter:
+    """Politeness: lets at most one player lookup start per `min_interval` seconds, over all workers."""
+
+    def __init__(self, min_interval: float = 0.0):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _session(worker_id):
+    """A browser on the site with the consent flow handled; quit again when that fails."""
+    driver = scrape.startDriver(f"{scrape.CHROME_PROFILE_DIR}-{worker_id}")
+    wait = WebDriverWait(driver, 10)
+    try:
+        scrape.ensureConsent(wait, driver)
+    except Exception:
+        scrape.Quit(driver)
+        raise
+    return driver, wait
+
+
+def _worker(worker_id, next_job, report, db_path, incremental, archive, limiter, metrics, pipeline):
+    scrape_metrics.activate(metrics)
+    conn = db.connect(db_path)
+    c = conn.cursor()
+    # one long-lived browser per worker: startup + consent happen only once, unless the session dies;
+    # then it is replaced before the next job, so a broken browser costs a job and never the worker
+    driver = wait = None
+    try:
+        driver, wait = _session(worker_id)
+    except Exception as e:
+        print(f'[worker {worker_id}] browser start mislukt, volgende job opnieuw: {e!r}')
+    try:
+        while True:
+            nr = next_job()
+            if nr is None:
+                break
+            if limiter is not None:
+                limiter.wait()
+            player_name = error = None
+            try:
+                if driver is None:
+                    driver, wait = _session(worker_id)
+                player_name = scrape.scrapePlayer(nr, driver, wait, c, conn, incremental=incremental, archive=archive,
+                                                  pipeline=pipeline)
+            except Exception as e:
+                conn.rollback()
+                error = e
+                if driver is not None:
+                    # get the session back to a known page before the next player; a dead one is replaced
+                    try:
+                        driver.get(scrape.START_URL)
+                    except Exception:
+                        scrape.Quit(driver)
+                        driver = None
+            if pipeline is not None:
+                # done once the pipeline stored the player's pages, not when they were handed over
+                stored = pipeline.wait(nr)
+                error = error or stored
+            if error is not None:
+                print(f'[worker {worker_id}] {nr} mislukt: {error!r}')
+            report(nr, player_name, None if error is None else repr(error))
+    finally:
+        conn.close()
+        if driver is not None:
+            scrape.Quit(driver)
+
+
+def run_pool(next_job, report, pool_size: int, db_path: str = DB_PATH, incremental: bool = False,
+             archive=None, limiter=None, metrics=None, pipeline=None):
+    """
+        Runs `pool_size` browser workers until next_job() returns None;
+        next_job may block while it waits for work, the browsers stay open.
+        report(job, player_name, error) is called after every job. All
+        workers record their timings into the shared `metrics` and, when a
+        scrape_pipeline.PagePipeline is given, hand their pages to it; a job
+        is then reported once its pages are stored, with their first error.
+    """
+    threads = [
+        threading.Thread(target=_worker, args=(i, next_job, report, db_path, incremental, archive, limiter, metrics, pipeline),
+                         daemon=True)
+        for i in range(pool_size)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def batch_scrape(numbers, pool_size: int = 4, db_path: str = DB_PATH, incremental: bool = False,
+                 archive_dir=None) -> list:
+    """
+        Spreads the member numbers over `pool_size` browser sessions, each
+        running in its own thread. Returns a list of (member_nr, player_name,
+        error) tuples and prints the throughput at the end.
+    """
+    numbers = read_member_numbers(numbers)
+
+    conn = db.connect(db_path)
+    db.init_schema(conn)
+    conn.close()
+
+    archive = PageArchive(archive_dir) if archive_dir else None
+    jobs = queue.Queue()
+    for nr in numbers:
+        jobs.put(nr)
+    results = []
+
+    def next_job():
+        try:
+            return jobs.get_nowait()
+        except queue.Empty:
+            return None
+
+    def report(nr, player_name, error):
+        results.append((nr, player_name, error))
+
+    pool_size = max(1, min(pool_size, len(numbers)))
+    metrics = ScrapeMetrics(mode='batch', pool_size=pool_size, players=len(numbers))
+    started = time.perf_counter()
+    # one pipeline for all sessions: a single writer keeps SQLite free of lock contention
+    with PagePipeline(db_path, parse_workers=2, queue_size=2 * pool_size, metrics=metrics) as pipeline:
+        run_pool(next_job, report, pool_size, db_path, incremental, archive, metrics=metrics, pipeline=pipeline)
+    match_snapshot.refresh_if_present(db_path)
+    elapsed = time.perf_counter() - started
+
+    ok = sum(1 for _, _, err in results if err is None)
+    per_minute = ok / (elapsed / 60) if elapsed > 0 else 0.0
+    metrics.labels['players_per_minute'] = round(per_minute, 2)
+    metrics.write()
+    print(f"{ok}/{len(numbers)} spelers gescraped met {pool_size} sessies "
+          f"in {elapsed:.1f}s ({per_minute:.1f} spelers/min)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape many KNLTB member numbers at once.")
+    parser.add_argument("members", nargs="+",
+                        help="member numbers, or a single path to a file with one number per line")
+    parser.add_argument("--pool-size", type=int, default=4, help="number of browser sessions")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--incremental", action="store_true",
+                        help="only open the current season and seasons not yet fully stored")
+    parser.add_argument("--archive", help="also store every fetched page in this page archive directory")
+    args = parser.parse_args()
+
+    source = args.members[0] if len(args.members) == 1 and Path(args.members[0]).is_file() else args.members
+    batch_scrape(source, pool_size=args.pool_size, db_path=args.db, incremental=args.incremental,
+                 archive_dir=args.archive)
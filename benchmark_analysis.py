@@ -0,0 +1,345 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import analysis
+import player_stats
+
+PLAYER = 'Floris Bokx'
+
+
+def synthetic_history(n, player=PLAYER, seed=0) -> pd.DataFrame:
+    """
+        `n` matches of `player` shaped like SELECT * FROM matches: the player
+        on either side, ~30% three-setters, now and then a missing rating.
+    """
+    rng = np.random.default_rng(seed)
+    opponents = np.array([f'Opponent {i}' for i in range(2000)], dtype=object)
+    opp = opponents[rng.integers(0, len(opponents), n)]
+    is_p1 = rng.random(n) < 0.5
+    three = rng.random(n) < 0.3
+
+    df = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'player1': np.where(is_p1, player, opp),
+        'rating1': np.round(rng.uniform(3, 9, n), 4),
+        'player2': np.where(is_p1, opp, player),
+        'rating2': np.round(rng.uniform(3, 9, n), 4),
+    })
+    for i in (1, 2, 3):
+        for p in (1, 2):
+            games = rng.integers(0, 8, n).astype(float)
+            df[f'set{i}_p{p}'] = np.where(three, games, np.nan) if i == 3 else games
+    df.loc[rng.random(n) < 0.01, 'rating2'] = np.nan
+    df['winner'] = np.where(rng.random(n) < 0.5, df['player1'], df['player2'])
+    df['match_date'] = pd.Timestamp('2010-01-01') + pd.to_timedelta(rng.integers(0, 5000, n), unit='D')
+    return df
+
+
+def enrich_dataframe_rowwise(df: pd.DataFrame, player: str) -> pd.DataFrame:
+    """The row-by-row enrich_dataframe analysis.py used to have; the reference for the vectorized one."""
+    df = df.copy()
+    df["is_p1"] = df["player1"] == player
+    df["floris_rating"] = df.apply(lambda r: r["rating1"] if r["is_p1"] else r["rating2"], axis=1)
+    df["opp_name"]   = df.apply(lambda r: r["player2"] if r["is_p1"] else r["player1"], axis=1)
+    df["opp_rating"] = df.apply(lambda r: r["rating2"] if r["is_p1"] else r["rating1"], axis=1)
+    for i in (1,2,3):
+        df[f"set{i}_floris"] = df.apply(
+            lambda r: r[f"set{i}_p1"] if r["is_p1"] else r[f"set{i}_p2"], axis=1
+        )
+        df[f"set{i}_opp"] = df.apply(
+            lambda r: r[f"set{i}_p2"] if r["is_p1"] else r[f"set{i}_p1"], axis=1
+        )
+    df["won"] = df["winner"] == player
+    df["is_3set"] = df["set3_floris"].notna()
+    return df
+
+
+def check_enrich(df, player=PLAYER):
+    """Raises unless both versions give the same values; the reference is cast to the compact dtypes first."""
+    new = analysis.enrich_dataframe(df, player)
+    reference = enrich_dataframe_rowwise(df, player).astype(new.dtypes.to_dict())
+    pd.testing.assert_frame_equal(new, reference)
+
+
+def compute_statistics_reference(df: pd.DataFrame) -> dict:
+    """compute_statistics as it was before the single-pass kernel; the golden reference."""
+    stats = {}
+    n = len(df)
+
+    # 1) Matches won/lost
+    stats["won"] = df["won"].sum()
+    stats["lost"] = n - stats["won"]
+
+    # 2) Won/lost in 3 sets
+    stats["won_3"]  = df[df["won"]  & df["is_3set"]].shape[0]
+    stats["lost_3"] = df[~df["won"] & df["is_3set"]].shape[0]
+
+    # 3) Longest win-streak (unchanged)
+    def longest_streak(series):
+        max_s = cur = 0
+        for x in series:
+            cur = cur+1 if x else 0
+            max_s = max(max_s, cur)
+        return max_s
+    stats["longest_streak"] = longest_streak(df.sort_values("match_date")["won"])
+
+    # 4) Tiebreaks won/lost (unchanged)
+    tbw = tbl = 0
+    for i in (1,2,3):
+        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
+        tb = ((sf==7)&(so==6))|((sf==6)&(so==7))
+        tbw += int(((sf>so)& tb).sum())
+        tbl += int(((so>sf)& tb).sum())
+    stats["tb_won"], stats["tb_lost"] = tbw, tbl
+
+    # 5) Comeback rate (down 0–1 → win)
+    dropped1 = df[df["set1_floris"] < df["set1_opp"]]
+    stats["comebacks"] = dropped1["won"].sum()
+    stats["comeback_rate"] = (
+        stats["comebacks"] / len(dropped1)
+        if len(dropped1)>0 else 0.0
+    )
+    # conversion rate
+    won1 = df[df["set1_floris"] > df["set1_opp"]]
+    stats["converted"] = won1["won"].sum()
+    stats["conversion_rate"] = (
+        stats["converted"] / len(won1)
+        if len(won1) > 0 else 0.0
+    )
+
+    # A) Set-win percentage
+    total_sets = 0
+    sets_won   = 0
+    for i in (1,2,3):
+        sf = df[f"set{i}_floris"]
+        so = df[f"set{i}_opp"]
+        played = sf.notna() & so.notna()
+        total_sets += int(played.sum())
+        sets_won   += int(((sf>so)& played).sum())
+    stats["set_win_pct"] = sets_won / total_sets if total_sets else 0.0
+
+    # B) Games-won percentage
+    gf = go = 0
+    for i in (1,2,3):
+        sf = df[f"set{i}_floris"].fillna(0)
+        so = df[f"set{i}_opp"].fillna(0)
+        gf += sf.sum()
+        go += so.sum()
+    stats["game_win_pct"] = gf / (gf+go) if (gf+go)>0 else 0.0
+
+    # C) Performance vs higher-rated opponents
+    upsets = df[df["opp_rating"] < df["floris_rating"]]
+    favours = df[df["opp_rating"] >= df["floris_rating"]]
+    stats["upset_win_pct"] = (
+        upsets["won"].sum() / len(upsets)
+        if len(upsets)>0 else None
+    )
+    stats["favoured_win_pct"] = (
+        favours["won"].sum() / len(favours)
+        if len(favours)>0 else None
+    )
+
+    # D) Straight-sets vs 3-sets ratio (of wins)
+    wins = df[df["won"]]
+    straight = wins[~wins["is_3set"]].shape[0]
+    three    = wins[wins["is_3set"]].shape[0]
+    stats["straight_vs_3_ratio"] = (straight, three)
+
+    # E) Close-set outcomes (7-5 / 5-7)
+    csw = csl = 0
+    for i in (1,2,3):
+        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
+        mask75 = (sf==7)&(so==5)
+        mask57 = (sf==5)&(so==7)
+        csw += int(mask75.sum())
+        csl += int(mask57.sum())
+    stats["close_set_won"], stats["close_set_lost"] = csw, csl
+
+    # F) Bagels (6-0) & Breadsticks (6-1)
+    bagels_won = bread_won = bagels_lost = bread_lost = 0
+    for i in (1,2,3):
+        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
+        played = sf.notna() & so.notna()
+        bagels_won  += int(((sf==6)&(so==0)& played).sum())
+        bread_won   += int(((sf==6)&(so==1)& played).sum())
+        bagels_lost += int(((so==6)&(sf==0)& played).sum())
+        bread_lost  += int(((so==6)&(sf==1)& played).sum())
+    stats["bagels_won"]  = bagels_won
+    stats["bread_won"]   = bread_won
+    stats["bagels_lost"] = bagels_lost
+    stats["bread_lost"]  = bread_lost
+
+    # G) Best/Worst & averages (unchanged from before)
+    beaten = df[df["won"]]
+    lostto = df[~df["won"]]
+
+    if not beaten.empty:
+        bb_row = beaten.loc[beaten["opp_rating"].idxmin()]
+        stats["best_beaten"] = {
+            "opponent": bb_row["opp_name"],
+            "rating": bb_row["opp_rating"]
+        }
+        stats["avg_rating_beaten"] = beaten["opp_rating"].mean()
+
+    if not lostto.empty:
+        wl_row = lostto.loc[lostto["opp_rating"].idxmax()]
+        stats["worst_lost_to"] = {
+            "opponent": wl_row["opp_name"],
+            "rating": wl_row["opp_rating"]
+        }
+        stats["avg_rating_lostto"] = lostto["opp_rating"].mean()
+
+    for i in (1, 2, 3):
+        sf = df[f"set{i}_floris"]
+        so = df[f"set{i}_opp"]
+        played = sf.notna() & so.notna()
+        wins = ((sf > so) & played).sum()
+        total = played.sum()
+        stats[f"set{i}_win_pct"] = wins / total if total else None
+
+        # Biggest upset win
+    wins_df = df[df["won"]].copy()  # <-- copy() here
+    wins_df["rating_diff"] = wins_df["floris_rating"] - wins_df["opp_rating"]
+    upsets = wins_df[wins_df["rating_diff"] > 0]
+    if not upsets.empty:
+        uw = upsets.loc[upsets["rating_diff"].idxmax()]
+        stats["biggest_upset_win"] = {
+            "opponent": uw["opp_name"],
+            "rating_diff": uw["rating_diff"]
+        }
+    else:
+        stats["biggest_upset_win"] = None
+
+    # Biggest bad-beat loss
+    losses_df = df[~df["won"]].copy()  # <-- and copy() here
+    losses_df["rating_diff"] = losses_df["opp_rating"] - losses_df["floris_rating"]
+    bad_beats = losses_df[losses_df["rating_diff"] > 0]
+    if not bad_beats.empty:
+        bb = bad_beats.loc[bad_beats["rating_diff"].idxmax()]
+        stats["biggest_bad_beat_loss"] = {
+            "opponent": bb["opp_name"],
+            "rating_diff": bb["rating_diff"]
+        }
+    else:
+        stats["biggest_bad_beat_loss"] = None
+    return stats
+
+
+def _same(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, (int, float, np.number)) and isinstance(b, (int, float, np.number)):
+        return bool(np.isclose(a, b, rtol=1e-9, atol=0))
+    return a == b
+
+
+def check_statistics(df, player=PLAYER):
+    """Raises unless the single-pass kernel returns the same statistics as the reference implementation."""
+    enriched = analysis.enrich_dataframe(df, player)
+    new, reference = analysis.compute_statistics(enriched), compute_statistics_reference(enriched)
+    for key in reference.keys() | new.keys():
+        if not _same(new.get(key), reference.get(key)):
+            raise AssertionError(f"{key}: {new.get(key)!r} != {reference.get(key)!r}")
+
+
+def synthetic_league(players, per_player, seed=0) -> pd.DataFrame:
+    """A player_stats.load_player_frame-shaped frame: `per_player` matches for each of `players` players."""
+    rng = np.random.default_rng(seed)
+    n = players * per_player
+    df = pd.DataFrame({
+        'player_id': np.repeat(np.arange(1, players + 1), per_player),
+        'id': np.arange(1, n + 1),
+        # one match per player per day keeps the streak order unambiguous
+        'match_date': pd.Timestamp('2010-01-01') + pd.to_timedelta(
+            np.concatenate([rng.permutation(per_player) for _ in range(players)]), unit='D'),
+        'opp_name': np.array([f'Opponent {i}' for i in range(2000)], dtype=object)[rng.integers(0, 2000, n)],
+        'floris_rating': np.round(rng.uniform(3, 9, n), 4),
+        'opp_rating': np.round(rng.uniform(3, 9, n), 4),
+        'won': rng.random(n) < 0.5,
+    })
+    three = rng.random(n) < 0.3
+    for i in (1, 2, 3):
+        for side in ('floris', 'opp'):
+            games = rng.integers(0, 8, n).astype(float)
+            df[f'set{i}_{side}'] = np.where(three, games, np.nan) if i == 3 else games
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def _per_player(frame):
+    frame = frame.assign(is_3set=frame["set3_floris"].notna())
+    return {pid: analysis.compute_statistics(group) for pid, group in frame.groupby("player_id")}
+
+
+def check_player_stats(frame):
+    """Raises unless player_stats.grouped_statistics agrees with compute_statistics run per player."""
+    grouped = player_stats.grouped_statistics(frame)
+    for pid, stats in _per_player(frame).items():
+        row = grouped.loc[pid]
+        flat = {k: v for k, v in stats.items() if not isinstance(v, (dict, tuple)) and v is not None}
+        flat["straight_won"] = stats["straight_vs_3_ratio"][0]
+        for key, value_key, suffix in (("best_beaten", "rating", "_rating"), ("worst_lost_to", "rating", "_rating"),
+                                       ("biggest_upset_win", "rating_diff", "_diff"),
+                                       ("biggest_bad_beat_loss", "rating_diff", "_diff")):
+            if stats.get(key):
+                flat[key], flat[key + suffix] = stats[key]["opponent"], stats[key][value_key]
+        for key, value in flat.items():
+            if not _same(value, row[key]):
+                raise AssertionError(f"player {pid} {key}: {row[key]!r} != {value!r}")
+
+
+def timed(fn, *args, repeat=1):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time the analysis kernels on a synthetic history.")
+    parser.add_argument("--matches", type=int, default=1_000_000)
+    parser.add_argument("--players", type=int, default=2000, help="players in the synthetic league")
+    parser.add_argument("--check-matches", type=int, default=20_000,
+                        help="size of the history the vectorized and row-wise versions are compared on")
+    args = parser.parse_args()
+
+    check_enrich(synthetic_history(args.check_matches, seed=1))
+    print(f"enrich_dataframe: gelijk aan de rij-voor-rij versie op {args.check_matches} wedstrijden")
+
+    for seed in range(5):
+        check_statistics(synthetic_history(args.check_matches, seed=seed))
+        check_statistics(synthetic_history(50, seed=seed))
+    print(f"compute_statistics: gelijk aan de referentie op {args.check_matches} en 50 wedstrijden")
+
+    check_player_stats(synthetic_league(200, 100, seed=2))
+    print("player_stats: gelijk aan compute_statistics per speler op 200 spelers")
+
+    df = synthetic_history(args.matches)
+    rowwise = timed(enrich_dataframe_rowwise, df, PLAYER)
+    vectorized = timed(analysis.enrich_dataframe, df, PLAYER, repeat=3)
+    old_mb = enrich_dataframe_rowwise(df, PLAYER).memory_usage(deep=True).sum() / 1e6
+    new_mb = analysis.enrich_dataframe(df, PLAYER).memory_usage(deep=True).sum() / 1e6
+    print(f"enrich_dataframe op {args.matches} wedstrijden: rij-voor-rij {rowwise:.2f}s, "
+          f"gevectoriseerd {vectorized:.3f}s ({rowwise / vectorized:.0f}x), "
+          f"{old_mb:.0f} MB -> {new_mb:.0f} MB")
+
+    enriched = analysis.enrich_dataframe(df, PLAYER)
+    reference = timed(compute_statistics_reference, enriched, repeat=3)
+    kernel = timed(analysis.compute_statistics, enriched, repeat=3)
+    print(f"compute_statistics op {args.matches} wedstrijden: per metriek {reference:.3f}s, "
+          f"in één keer {kernel:.3f}s ({reference / kernel:.1f}x)")
+    subset = ["won", "tb_won", "set1_win_pct"]
+    lazy = timed(analysis.compute_statistics, enriched, subset, repeat=3)
+    print(f"compute_statistics met alleen {subset}: {lazy:.3f}s")
+
+    league = synthetic_league(args.players, max(1, args.matches // args.players))
+    one_by_one = timed(_per_player, league)
+    grouped = timed(player_stats.grouped_statistics, league, repeat=3)
+    print(f"statistieken voor {args.players} spelers ({len(league)} rijen): per speler {one_by_one:.2f}s, "
+          f"gegroepeerd {grouped:.3f}s ({one_by_one / grouped:.0f}x)")
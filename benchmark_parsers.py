@@ -0,0 +1,53 @@
+import argparse
+import time
+from pathlib import Path
+
+import match_parser
+
+
+def load_pages(paths) -> list:
+    """Reads saved rating pages; directories are searched for *.html files."""
+    pages = []
+    for p in map(Path, paths):
+        files = sorted(p.rglob('*.html')) if p.is_dir() else [p]
+        pages += [f.read_text(encoding='utf-8', errors='replace') for f in files]
+    return pages
+
+
+def benchmark(pages, backends=None, repeat=5) -> dict:
+    """Match records parsed per second for every backend, best of `repeat` runs."""
+    results = {}
+    for backend in backends or match_parser.available_backends():
+        best = float('inf')
+        records = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            records = sum(len(match_parser.parse_matches(html, backend)) for html in pages)
+            best = min(best, time.perf_counter() - start)
+        results[backend] = {
+            'records': records,
+            'seconds': best,
+            'records_per_sec': records / best if best > 0 else 0.0,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare match_parser backends on saved rating pages.")
+    parser.add_argument("pages", nargs="+", help="saved .html pages or directories containing them")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages)
+    results = benchmark(pages, repeat=args.repeat)
+
+    # all backends must agree before their speed means anything
+    reference = [match_parser.parse_matches(html, 'bs4') for html in pages]
+    for backend in results:
+        same = [match_parser.parse_matches(html, backend) for html in pages] == reference
+        results[backend]['matches_bs4'] = same
+
+    print(f"{len(pages)} pages")
+    for backend, r in sorted(results.items(), key=lambda kv: -kv[1]['records_per_sec']):
+        print(f"{backend:<11} {r['records']:>6} records  {r['seconds']*1000:8.1f} ms  "
+              f"{r['records_per_sec']:>10.0f} records/s  {'ok' if r['matches_bs4'] else 'MISMATCH'}")
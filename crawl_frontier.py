@@ -0,0 +1,146 @@
+import argparse
+import threading
+import time
+from datetime import datetime
+
+import db
+import match_snapshot
+from batch_scrape import RateLimiter, run_pool
+from page_archive import PageArchive
+
+DB_PATH = db.DB_PATH
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 15 * 60   # seconds, doubled on every failed attempt
+
+# how often a player shows up, discounted by how long ago their last match was
+PRIORITY = "appearances * 1.0 / (1 + (julianday('now') - julianday(COALESCE(last_seen, '2000-01-01'))) / 365.0)"
+
+
+def recover(conn) -> int:
+    """Puts players that were being scraped when the crawler died back in the queue."""
+    with conn:
+        return conn.execute(
+            "UPDATE crawl_frontier SET status = 'pending' WHERE status = 'in_progress'"
+        ).rowcount
+
+
+def discover(conn) -> int:
+    """
+        Adds every opponent in `matches` that has no entry in current_ratings
+        yet, and refreshes appearance counts and last-seen dates of the ones
+        already queued. Returns the number of pending players.
+    """
+    now = datetime.now().isoformat(timespec='seconds')
+    with conn:
+        conn.execute('''
+            INSERT INTO crawl_frontier (name, appearances, last_seen, updated_at)
+            SELECT name, COUNT(*), MAX(match_date), ?
+              FROM (SELECT player1 AS name, match_date FROM matches
+                    UNION ALL
+                    SELECT player2 AS name, match_date FROM matches)
+             WHERE name IS NOT NULL
+               AND name NOT IN (SELECT name FROM current_ratings)
+             GROUP BY name
+            ON CONFLICT(name) DO UPDATE SET
+                appearances = excluded.appearances,
+                last_seen   = excluded.last_seen
+        ''', (now,))
+        # scraped some other way in the meantime (batch, Streamlit, ...)
+        conn.execute('''
+            UPDATE crawl_frontier SET status = 'done', updated_at = ?
+             WHERE status = 'pending' AND name IN (SELECT name FROM current_ratings)
+        ''', (now,))
+    return conn.execute("SELECT COUNT(*) FROM crawl_frontier WHERE status = 'pending'").fetchone()[0]
+
+
+def claim(conn):
+    """Highest-priority pending player whose retry time has come, marked in_progress."""
+    with conn:
+        row = conn.execute(f'''
+            SELECT name FROM crawl_frontier
+             WHERE status = 'pending' AND next_attempt_at <= ?
+             ORDER BY {PRIORITY} DESC
+             LIMIT 1
+        ''', (time.time(),)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE crawl_frontier SET status = 'in_progress', updated_at = ? WHERE name = ?",
+            (datetime.now().isoformat(timespec='seconds'), row[0]),
+        )
+    return row[0]
+
+
+def finish(conn, name, player_name, error):
+    now = datetime.now().isoformat(timespec='seconds')
+    with conn:
+        if error is None:
+            # the site search is by name, so note which profile it actually led to
+            conn.execute('''
+                UPDATE crawl_frontier SET status = 'done', scraped_as = ?, last_error = NULL, updated_at = ?
+                 WHERE name = ?
+            ''', (player_name, now, name))
+            return
+        attempts = conn.execute("SELECT attempts FROM crawl_frontier WHERE name = ?", (name,)).fetchone()[0] + 1
+        conn.execute('''
+            UPDATE crawl_frontier
+               SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+             WHERE name = ?
+        ''', ('failed' if attempts >= MAX_ATTEMPTS else 'pending', attempts,
+              time.time() + RETRY_BACKOFF * 2 ** (attempts - 1), error, now, name))
+
+
+def crawl(db_path=DB_PATH, pool_size=2, min_interval=5.0, max_players=None, archive_dir=None):
+    """
+        Scrapes discovered opponents in priority order with `pool_size`
+        browsers, starting at most one player every `min_interval` seconds.
+        New opponents found along the way join the frontier. Safe to stop
+        at any moment and start again.
+    """
+    conn = db.connect(db_path, check_same_thread=False)
+    db.init_schema(conn)
+    resumed = recover(conn)
+    pending = discover(conn)
+    print(f"{pending} spelers in de wachtrij ({resumed} hervat)")
+
+    lock = threading.Lock()
+    claimed = {'count': 0}
+
+    def next_job():
+        with lock:
+            if max_players is not None and claimed['count'] >= max_players:
+                return None
+            name = claim(conn)
+            if name is None and discover(conn):
+                name = claim(conn)
+            if name is not None:
+                claimed['count'] += 1
+            return name
+
+    def report(name, player_name, error):
+        with lock:
+            finish(conn, name, player_name, error)
+
+    started = time.perf_counter()
+    archive = PageArchive(archive_dir) if archive_dir else None
+    run_pool(next_job, report, pool_size, db_path, incremental=True, archive=archive,
+             limiter=RateLimiter(min_interval))
+    match_snapshot.refresh_if_present(db_path)
+    elapsed = time.perf_counter() - started
+
+    print(f"{claimed['count']} spelers gecrawld in {elapsed:.1f}s, "
+          f"{discover(conn)} nog in de wachtrij")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl opponents found in stored matches.")
+    parser.add_argument("--pool-size", type=int, default=2, help="number of browser sessions")
+    parser.add_argument("--min-interval", type=float, default=5.0,
+                        help="seconds between two player lookups, over all sessions")
+    parser.add_argument("--max-players", type=int, help="stop after this many players")
+    parser.add_argument("--archive", help="also store every fetched page in this page archive directory")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    crawl(args.db, args.pool_size, args.min_interval, args.max_players, args.archive)
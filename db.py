@@ -0,0 +1,179 @@
+import sqlite3
+import threading
+
+import migrations
+
+DB_PATH = 'matches.db'
+
+# WAL lets the dashboard read while a scraper writes; NORMAL is durable enough
+# in WAL mode and avoids an fsync per transaction
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,          # KiB, i.e. 64 MB page cache
+    'mmap_size': 256 * 1024 ** 2,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'OFF',
+}
+BUSY_TIMEOUT = 30            # seconds a writer waits for a lock instead of failing
+STATEMENT_CACHE = 256        # prepared statements kept per connection
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS players (
+    id        INTEGER PRIMARY KEY,
+    name      TEXT UNIQUE,
+    member_nr TEXT
+);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    player1 TEXT,
+    rating1 REAL,
+    player2 TEXT,
+    rating2 REAL,
+    set1_p1 INTEGER,
+    set1_p2 INTEGER,
+    set2_p1 INTEGER,
+    set2_p2 INTEGER,
+    set3_p1 INTEGER,
+    set3_p2 INTEGER,
+    winner TEXT,
+    match_date DATE,
+    match_key TEXT,
+    player1_id INTEGER REFERENCES players(id),
+    player2_id INTEGER REFERENCES players(id),
+    winner_id  INTEGER REFERENCES players(id)
+);
+
+CREATE TABLE IF NOT EXISTS current_ratings (
+    name   TEXT,
+    rating REAL,
+    date   DATE,
+    player_id INTEGER REFERENCES players(id)
+);
+
+-- which seasons of which player have been stored, for incremental scrapes
+CREATE TABLE IF NOT EXISTS scraped_seasons (
+    member_nr    TEXT,
+    season       TEXT,
+    player_name  TEXT,
+    complete     INTEGER,
+    newest_match DATE,
+    matches      INTEGER,
+    scraped_at   TEXT,
+    PRIMARY KEY (member_nr, season)
+);
+
+CREATE TABLE IF NOT EXISTS crawl_frontier (
+    name            TEXT PRIMARY KEY,
+    appearances     INTEGER,
+    last_seen       DATE,
+    status          TEXT DEFAULT 'pending',   -- pending / in_progress / done / failed
+    attempts        INTEGER DEFAULT 0,
+    next_attempt_at REAL DEFAULT 0,
+    scraped_as      TEXT,
+    last_error      TEXT,
+    updated_at      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_crawl_frontier_status ON crawl_frontier(status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+    id          INTEGER PRIMARY KEY,
+    member_nr   TEXT,
+    status      TEXT DEFAULT 'queued',   -- queued / running / done / failed
+    attempts    INTEGER DEFAULT 0,
+    run_after   REAL DEFAULT 0,
+    created_at  TEXT,
+    started_at  TEXT,
+    finished_at TEXT,
+    player_name TEXT,
+    last_error  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scrape_jobs_status ON scrape_jobs(status, run_after);
+CREATE INDEX IF NOT EXISTS idx_scrape_jobs_member ON scrape_jobs(member_nr, status);
+
+-- where an interrupted remove_dups.dedupe run continues
+CREATE TABLE IF NOT EXISTS dedup_progress (
+    task    TEXT PRIMARY KEY,
+    last_id INTEGER
+);
+
+-- compute_statistics for every player, see player_stats.refresh; `watermark`
+-- is the highest player_matches.id the row was computed from
+CREATE TABLE IF NOT EXISTS player_stats (
+    player_id        INTEGER PRIMARY KEY,
+    matches          INTEGER,
+    won              INTEGER,
+    lost             INTEGER,
+    won_3            INTEGER,
+    lost_3           INTEGER,
+    tb_won           INTEGER,
+    tb_lost          INTEGER,
+    comebacks        INTEGER,
+    converted        INTEGER,
+    straight_won     INTEGER,
+    close_set_won    INTEGER,
+    close_set_lost   INTEGER,
+    bagels_won       INTEGER,
+    bread_won        INTEGER,
+    bagels_lost      INTEGER,
+    bread_lost       INTEGER,
+    comeback_rate    REAL,
+    conversion_rate  REAL,
+    set_win_pct      REAL,
+    game_win_pct     REAL,
+    upset_win_pct    REAL,
+    favoured_win_pct REAL,
+    set1_win_pct     REAL,
+    set2_win_pct     REAL,
+    set3_win_pct     REAL,
+    longest_streak   INTEGER,
+    best_beaten                TEXT,
+    best_beaten_rating         REAL,
+    worst_lost_to              TEXT,
+    worst_lost_to_rating       REAL,
+    biggest_upset_win          TEXT,
+    biggest_upset_win_diff     REAL,
+    biggest_bad_beat_loss      TEXT,
+    biggest_bad_beat_loss_diff REAL,
+    avg_rating_beaten REAL,
+    avg_rating_lostto REAL,
+    watermark        INTEGER,
+    computed_at      TEXT
+);
+
+-- players' ids on matches/current_ratings and the trigger-maintained
+-- player_matches table are created by migrations.migrate
+'''
+
+
+def connect(db_path=DB_PATH, **kwargs) -> sqlite3.Connection:
+    """A new connection with the tuned pragmas applied."""
+    kwargs.setdefault('timeout', BUSY_TIMEOUT)
+    kwargs.setdefault('cached_statements', STATEMENT_CACHE)
+    conn = sqlite3.connect(db_path, **kwargs)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+_local = threading.local()
+
+
+def get_connection(db_path=DB_PATH) -> sqlite3.Connection:
+    """
+        The calling thread's cached connection to `db_path`, opened on first
+        use. Meant for readers (reports, the dashboard); do not close it.
+    """
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    if db_path not in conns:
+        conns[db_path] = connect(db_path)
+    return conns[db_path]
+
+
+def init_schema(conn):
+    """Creates all tables and brings older databases up to date."""
+    conn.executescript(SCHEMA)
+    migrations.migrate(conn)
@@ -0,0 +1,160 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import urllib3
+from bs4 import BeautifulSoup, SoupStrainer
+
+import db
+import page_archive
+import player_rating_progression_scrape as scrape
+
+DB_PATH = db.DB_PATH
+SITE_URL = "https://mijnknltb.toernooi.nl"
+USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+
+
+def export_cookies(driver) -> dict:
+    """Copies the session cookies out of a browser on which consent was accepted."""
+    return {c['name']: c['value'] for c in driver.get_cookies()}
+
+
+class HttpFetcher:
+    """
+        Fetches pages over a pooled keep-alive connection, sending the cookies
+        exported from the browser. `base_url` replaces scheme and host of every
+        URL, so saved pages can be served from a local stand-in server.
+    """
+
+    def __init__(self, cookies=None, base_url=None, max_workers=4, timeout=15):
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.http = urllib3.PoolManager(maxsize=max_workers, block=True, retries=urllib3.Retry(3, backoff_factor=0.5))
+        self.headers = {"User-Agent": USER_AGENT}
+        if cookies:
+            self.headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+
+    def url(self, path_or_url):
+        url = urljoin(SITE_URL, path_or_url)
+        if self.base_url:
+            base = urlsplit(self.base_url)
+            parts = urlsplit(url)
+            url = urlunsplit((base.scheme, base.netloc, parts.path, parts.query, ''))
+        return url
+
+    def get(self, path_or_url) -> str:
+        resp = self.http.request("GET", self.url(path_or_url), headers=self.headers, timeout=self.timeout)
+        if resp.status != 200:
+            raise RuntimeError(f"GET {path_or_url} gaf status {resp.status}")
+        return resp.data.decode("utf-8", errors="replace")
+
+    def get_many(self, paths) -> list:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.get, paths))
+
+
+def year_links(html, max_years=8) -> list:
+    """Hrefs of the non-active season tabs, including the ones in the 'more' dropdown."""
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('ul', class_='page-nav--pills'))
+    links = []
+    for li in soup.select('ul.page-nav--pills li'):
+        if 'page-nav__item--active' in (li.get('class') or []):
+            continue
+        a = li.find('a', href=True)
+        if a is None or a['href'].startswith(('#', 'javascript')):
+            continue
+        if a['href'] not in links:
+            links.append(a['href'])
+    return links[:max_years - 1]
+
+
+def active_season(html) -> str:
+    """Label of the active season tab, as the browser scrape reads it with activePill."""
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('ul', class_='page-nav--pills'))
+    active = soup.select_one('ul.page-nav--pills li.page-nav__item--active')
+    return active.get_text(strip=True) if active else None
+
+
+def scrape_profile_http(profile_url, fetcher, c, conn, inp=1, max_years=8, archive=None, member_nr=None):
+    """
+        Stores the current rating and all season pages of one player profile
+        (e.g. '/player-profile/<id>/Rating') using plain HTTP requests only.
+        Every page is also written to `archive` (a page_archive.PageArchive)
+        when given, under `member_nr` or else the player's name.
+    """
+    kind = page_archive.KINDS[inp]
+    html = fetcher.get(profile_url)
+    player_name = scrape.storeCurrentRating(html, c, conn, inp)
+    if member_nr is not None:
+        scrape.storeMemberNr(player_name, member_nr, c, conn)
+    if archive is not None:
+        archive.put(html, member_nr or player_name, active_season(html), kind, profile=True)
+    scrape.insertDB(html, c, conn)
+
+    # the season pages are fetched concurrently, the inserts stay on this thread
+    for year_html in fetcher.get_many(year_links(html, max_years)):
+        if archive is not None:
+            archive.put(year_html, member_nr or player_name, active_season(year_html), kind)
+        scrape.insertDB(year_html, c, conn)
+    return player_name
+
+
+def resolve_profiles(numbers):
+    """
+        Uses one browser session for the consent flow and the member-number
+        search, and returns (cookies, [profile_url, ...]).
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver = scrape.startDriver(scrape.CHROME_PROFILE_DIR)
+    wait = WebDriverWait(driver, 10)
+    try:
+        scrape.ensureConsent(wait, driver)
+        profiles = []
+        for nr in numbers:
+            # the browser already shows a profile (the start page or the previous player),
+            # so the lookup has landed only once the URL moved away from it
+            previous = driver.current_url
+            scrape.playerLookup(nr, driver)
+            wait.until(lambda d: d.current_url != previous and '/player-profile/' in d.current_url)
+            profiles.append(urlsplit(driver.current_url).path)
+        return export_cookies(driver), profiles
+    finally:
+        scrape.Quit(driver)
+
+
+def main(numbers=(), profiles=(), base_url=None, db_path=DB_PATH, max_workers=4, archive_dir=None):
+    cookies = None
+    # (member_nr, profile path); a profile given directly has no known member number
+    profiles = [(None, profile) for profile in profiles]
+    if numbers:
+        cookies, found = resolve_profiles(numbers)
+        profiles += zip(numbers, found)
+
+    fetcher = HttpFetcher(cookies, base_url=base_url, max_workers=max_workers)
+    conn = db.connect(db_path)
+    c = conn.cursor()
+    db.init_schema(conn)
+    archive = page_archive.PageArchive(archive_dir) if archive_dir else None
+    try:
+        for member_nr, profile in profiles:
+            scrape_profile_http(profile, fetcher, c, conn, archive=archive, member_nr=member_nr)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape rating pages over HTTP after a one-time browser setup.")
+    parser.add_argument("members", nargs="*", help="KNLTB member numbers (resolved once in a browser)")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="profile path such as /player-profile/<id>/Rating; skips the browser")
+    parser.add_argument("--base-url", help="serve pages from here instead of the KNLTB site, e.g. http://localhost:8000")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--archive", help="also store every fetched page in this page archive directory")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    main(args.members, args.profile, base_url=args.base_url, db_path=args.db, max_workers=args.workers,
+         archive_dir=args.archive)
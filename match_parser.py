@@ -0,0 +1,243 @@
+import re
+from datetime import date, datetime
+from typing import List, NamedTuple, Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+except ImportError:  # optional backend
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:  # optional backend; older selectolax only ships the modest parser
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+
+class MatchRecord(NamedTuple):
+    player1: str
+    rating1: Optional[float]
+    player2: str
+    rating2: Optional[float]
+    set1_p1: Optional[int]
+    set1_p2: Optional[int]
+    set2_p1: Optional[int]
+    set2_p2: Optional[int]
+    set3_p1: Optional[int]
+    set3_p2: Optional[int]
+    winner: Optional[str]
+    match_date: Optional[date]
+
+
+class ProfileHeader(NamedTuple):
+    name: str
+    ratings: List[str]   # raw rating texts, singles first ('7,1234')
+
+
+RATING_RE = re.compile(r'\(([\d,\.]+)\)')
+
+
+def _rating(text):
+    m = RATING_RE.search(text)
+    return float(m.group(1).replace(',', '.')) if m else None
+
+
+def _match_date(text):
+    # strip off weekday (“za 10-5-2025” → “10-5-2025”)
+    date_part = text.split(' ', 1)[1]
+    return datetime.strptime(date_part, '%d-%m-%Y').date()
+
+
+def _record(players, sets, winner, date_text):
+    """Builds a MatchRecord from the texts every backend extracts in the same way."""
+    (p1, t1), (p2, t2) = players[0], players[1]
+    # pad to 3 sets
+    sets = [list(s) for s in sets[:3]]
+    while len(sets) < 3:
+        sets.append([None, None])
+    (s1a, s1b), (s2a, s2b), (s3a, s3b) = sets
+    return MatchRecord(
+        p1, _rating(t1), p2, _rating(t2),
+        s1a, s1b, s2a, s2b, s3a, s3b,
+        winner,
+        _match_date(date_text) if date_text else None,
+    )
+
+
+def _match_list(html):
+    """
+        The <ol> match list(s) cut out of a page by plain string search, so
+        the lxml and selectolax backends build a tree of just the matches
+        instead of the whole page (head, navigation, scripts). From the <ol>
+        around the first match item to the </ol> after the last one; the
+        whole page when that does not work out (no matches, other markup).
+    """
+    first = html.find('match-group__item')
+    if first == -1:
+        return html
+    start = html.rfind('<ol', 0, first)
+    end = html.find('</ol>', html.rfind('match-group__item'))
+    if start == -1 or end == -1:
+        return html
+    return html[start:end + len('</ol>')]
+
+
+# ---------------------------------------------------------------- bs4 backend
+
+def _parse_bs4(html):
+    # only build the <li class="match-group__item"> subtrees, not the whole page
+    only_matches = SoupStrainer('li', class_='match-group__item')
+    soup = BeautifulSoup(html, 'lxml' if lxml else 'html.parser', parse_only=only_matches)
+
+    for item in soup.find_all('li', class_='match-group__item'):
+        # check for scores: if empty, skip (match not played)
+        point_lists = item.select('.match__result .points')
+        if not point_lists:
+            continue
+
+        players = []
+        for row in item.select('.match__row-title-value-content')[:2]:
+            name = row.find('span', class_='nav-link__value').get_text(strip=True)
+            players.append((name, row.get_text()))
+
+        sets = [[int(li.get_text(strip=True)) for li in ul.select('.points__cell')] for ul in point_lists]
+
+        win_span = item.select_one('.match__row.has-won .nav-link__value')
+        date_elem = item.select_one('.match__footer .icon-clock + .nav-link__value')
+        yield _record(
+            players, sets,
+            win_span.get_text(strip=True) if win_span else None,
+            date_elem.get_text(strip=True) if date_elem else None,
+        )
+
+
+# --------------------------------------------------------------- lxml backend
+
+def _cls(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+LXML_ITEMS   = f"//li[{_cls('match-group__item')}]"
+LXML_POINTS  = f".//*[{_cls('match__result')}]//*[{_cls('points')}]"
+LXML_CELLS   = f".//*[{_cls('points__cell')}]"
+LXML_ROWS    = f".//*[{_cls('match__row-title-value-content')}]"
+LXML_NAME    = f".//span[{_cls('nav-link__value')}]"
+LXML_WINNER  = f".//*[{_cls('match__row')} and {_cls('has-won')}]//*[{_cls('nav-link__value')}]"
+LXML_DATE    = (f".//*[{_cls('match__footer')}]//*[{_cls('icon-clock')}]"
+                f"/following-sibling::*[1][{_cls('nav-link__value')}]")
+
+
+def _text(node):
+    return ''.join(s.strip() for s in node.itertext())
+
+
+def _parse_lxml(html):
+    tree = lxml.html.fromstring(_match_list(html))
+    for item in tree.xpath(LXML_ITEMS):
+        point_lists = item.xpath(LXML_POINTS)
+        if not point_lists:
+            continue
+
+        players = []
+        for row in item.xpath(LXML_ROWS)[:2]:
+            players.append((_text(row.xpath(LXML_NAME)[0]), row.text_content()))
+
+        sets = [[int(_text(li)) for li in ul.xpath(LXML_CELLS)] for ul in point_lists]
+
+        win_span = item.xpath(LXML_WINNER)
+        date_elem = item.xpath(LXML_DATE)
+        yield _record(
+            players, sets,
+            _text(win_span[0]) if win_span else None,
+            _text(date_elem[0]) if date_elem else None,
+        )
+
+
+# --------------------------------------------------------- selectolax backend
+
+def _parse_selectolax(html):
+    tree = HTMLParser(_match_list(html))
+    for item in tree.css('li.match-group__item'):
+        point_lists = item.css('.match__result .points')
+        if not point_lists:
+            continue
+
+        players = []
+        for row in item.css('.match__row-title-value-content')[:2]:
+            players.append((row.css_first('span.nav-link__value').text(separator='', strip=True), row.text()))
+
+        sets = [[int(li.text(strip=True)) for li in ul.css('.points__cell')] for ul in point_lists]
+
+        win_span = item.css_first('.match__row.has-won .nav-link__value')
+        date_elem = item.css_first('.match__footer .icon-clock + .nav-link__value')
+        yield _record(
+            players, sets,
+            win_span.text(separator='', strip=True) if win_span else None,
+            date_elem.text(separator='', strip=True) if date_elem else None,
+        )
+
+
+BACKENDS = {
+    'bs4': _parse_bs4,
+    'lxml': _parse_lxml,
+    'selectolax': _parse_selectolax,
+}
+
+
+def available_backends() -> List[str]:
+    names = ['bs4']
+    if lxml is not None:
+        names.append('lxml')
+    if HTMLParser is not None:
+        names.append('selectolax')
+    return names
+
+
+def default_backend() -> str:
+    # fastest installed backend first
+    for name in ('selectolax', 'lxml'):
+        if name in available_backends():
+            return name
+    return 'bs4'
+
+
+def parse_matches(html: str, backend: Optional[str] = None) -> List[MatchRecord]:
+    """All played matches on a rating page, as typed records."""
+    backend = backend or default_backend()
+    if backend not in available_backends():
+        raise ValueError(f"Parser backend '{backend}' is not installed (available: {available_backends()})")
+    return list(BACKENDS[backend](html))
+
+
+def parse_profile(html: str) -> ProfileHeader:
+    """Player name and current ratings from the profile header, without parsing the match list."""
+    only_header = SoupStrainer(class_=['media', 'tag-duo__value'])
+    soup = BeautifulSoup(html, 'lxml' if lxml else 'html.parser', parse_only=only_header)
+    media_snippet = soup.find('div', class_='media')
+    name = media_snippet.find('span', class_='nav-link__value').text
+    ratings = [span.text for span in soup.find_all('span', class_='tag-duo__value')]
+    return ProfileHeader(name, ratings)
+
+
+def match_key(player1, player2, sets, match_date) -> str:
+    """
+        Canonical identity of a match: the same match seen from either player's
+        page (or with the players listed the other way round) gives the same key.
+        `sets` holds (p1, p2) games per set, None for sets not played.
+    """
+    sets = [tuple(s) for s in sets]
+    if (player1 or '') > (player2 or ''):
+        player1, player2 = player2, player1
+        sets = [(b, a) for a, b in sets]
+    scores = ','.join('' if a is None else f'{a}-{b}' for a, b in sets)
+    return f"{match_date or ''}|{player1}|{player2}|{scores}"
+
+
+def record_key(m: MatchRecord) -> str:
+    return match_key(m.player1, m.player2,
+                     [(m.set1_p1, m.set1_p2), (m.set2_p1, m.set2_p2), (m.set3_p1, m.set3_p2)],
+                     m.match_date)
@@ -0,0 +1,261 @@
+import argparse
+import json
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+import db
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # optional; without it every read goes to SQLite
+    pa = pc = pq = None
+
+DB_PATH = db.DB_PATH
+FETCH_ROWS = 200_000
+ROW_GROUP_ROWS = 16_384     # small enough for per-player reads to skip most of a partition
+PLAYER_BUCKETS = 64
+# partition keys: matches per year (no date: year=0), a player's matches in one bucket file
+YEAR = "COALESCE(CAST(strftime('%Y', match_date) AS INTEGER), 0)"
+BUCKET = f"player_id % {PLAYER_BUCKETS}"
+
+# column -> Arrow type; strings are dictionary-encoded by the Parquet writer
+TABLES = {
+    'matches': {
+        'columns': {
+            'id': 'int64', 'player1': 'string', 'rating1': 'float32', 'player2': 'string', 'rating2': 'float32',
+            'set1_p1': 'int8', 'set1_p2': 'int8', 'set2_p1': 'int8', 'set2_p2': 'int8',
+            'set3_p1': 'int8', 'set3_p2': 'int8', 'winner': 'string', 'match_date': 'date32',
+            'player1_id': 'int32', 'player2_id': 'int32', 'winner_id': 'int32',
+        },
+        'order': 'id',
+        'id': 'id',
+        'partition': ('year', YEAR),
+    },
+    # sorted per player so a player's rows sit in few row groups
+    'player_matches': {
+        'columns': {
+            'match_id': 'int64', 'player_id': 'int32', 'match_date': 'date32', 'opponent_id': 'int32',
+            'self_name': 'string', 'opp_name': 'string', 'self_rating': 'float32', 'opp_rating': 'float32',
+            'set1_self': 'int8', 'set1_opp': 'int8', 'set2_self': 'int8', 'set2_opp': 'int8',
+            'set3_self': 'int8', 'set3_opp': 'int8', 'won': 'bool_',
+        },
+        'order': 'player_id, match_date',
+        'id': 'match_id',
+        'partition': ('bucket', BUCKET),
+    },
+    'current_ratings': {
+        'columns': {'name': 'string', 'rating': 'float32', 'date': 'date32', 'player_id': 'int32'},
+        'order': 'player_id, date',
+        'partition': None,
+    },
+}
+
+# player_matches columns under the names analysis' player frames use
+PLAYER_FRAME = {
+    'match_id': 'id', 'match_date': 'match_date', 'self_name': 'player', 'opp_name': 'opp_name',
+    'self_rating': 'floris_rating', 'opp_rating': 'opp_rating',
+    'set1_self': 'set1_floris', 'set1_opp': 'set1_opp', 'set2_self': 'set2_floris', 'set2_opp': 'set2_opp',
+    'set3_self': 'set3_floris', 'set3_opp': 'set3_opp', 'won': 'won',
+}
+
+
+def snapshot_dir(db_path=DB_PATH) -> Path:
+    """matches.db -> matches.snapshot/"""
+    return Path(db_path).with_suffix('.snapshot')
+
+
+def exists(db_path=DB_PATH) -> bool:
+    return pq is not None and (snapshot_dir(db_path) / 'manifest.json').exists()
+
+
+def _manifest(root):
+    path = root / 'manifest.json'
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _state(conn):
+    """(highest id, row count) of the source tables: enough to tell appends from other changes."""
+    return {
+        'matches': list(conn.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM matches").fetchone()),
+        'current_ratings': list(conn.execute("SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM current_ratings").fetchone()),
+    }
+
+
+_checked = {}
+
+
+def is_fresh(conn, db_path=DB_PATH) -> bool:
+    """
+        True when a snapshot exists and nothing was written to the database
+        since it was refreshed. The row counts are only taken again once
+        another connection committed (PRAGMA data_version) or the snapshot
+        changed, so `conn` should be a reader's connection.
+    """
+    if not exists(db_path):
+        return False
+    version = (conn.execute("PRAGMA data_version").fetchone()[0],
+               (snapshot_dir(db_path) / 'manifest.json').stat().st_mtime_ns)
+    cached = _checked.get((id(conn), db_path))
+    if cached and cached[0] == version:
+        return cached[1]
+    fresh = _manifest(snapshot_dir(db_path)).get('state') == _state(conn)
+    _checked[(id(conn), db_path)] = (version, fresh)
+    return fresh
+
+
+def _arrow_table(rows, columns):
+    arrays = []
+    for i, type_name in enumerate(columns.values()):
+        values = [row[i] for row in rows]
+        if type_name == 'string':
+            arrays.append(pa.array(values, type=pa.string()))
+        else:
+            # dates arrive as 'YYYY-MM-DD' text, set scores sometimes as REAL
+            arrays.append(pa.array(values, from_pandas=True).cast(getattr(pa, type_name)()))
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def _export(conn, table, dest, parts=None) -> int:
+    """Writes `table` under `dest`, one <key>=<value>/ directory per partition; only `parts` if given."""
+    spec = TABLES[table]
+    columns = spec['columns']
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in columns.items()])
+    key, expr = spec['partition'] or (None, None)
+    where = ''
+    if parts is not None:
+        where = f"WHERE {expr} IN ({', '.join('?' * len(parts))})"
+    key_column = f", {expr}" if key else ''
+    cursor = conn.execute(
+        f"SELECT {', '.join(columns)}{key_column} FROM {table} {where} ORDER BY {spec['order']}",
+        list(parts or ()),
+    )
+
+    writers = {}
+    written = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            data = _arrow_table(rows, columns)
+            if key:
+                values = pa.array([row[-1] for row in rows], type=pa.int32())
+                chunks = [(v, data.filter(pc.equal(values, v))) for v in pc.unique(values).to_pylist()]
+            else:
+                chunks = [(None, data)]
+            for v, chunk in chunks:
+                if v not in writers:
+                    path = dest / f'{key}={v}' / 'part-0.parquet' if key else dest / 'part-0.parquet'
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    writers[v] = pq.ParquetWriter(path, schema, compression='zstd')
+                writers[v].write_table(chunk, row_group_size=ROW_GROUP_ROWS)
+            written += len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return written
+
+
+def _replace(src, dst):
+    if dst.exists():
+        shutil.rmtree(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    src.replace(dst)
+
+
+def refresh(db_path=DB_PATH, full=False) -> dict:
+    """
+        Brings the Parquet snapshot next to the database up to date. When
+        `matches` only grew since the last refresh, just the partitions the
+        new rows fall in are rewritten; after deletes (dedup, replay) or with
+        `full` everything is exported again. current_ratings is small and
+        rewritten whenever it changed.
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is not installed")
+    started = time.perf_counter()
+    root = snapshot_dir(db_path)
+    tmp = root.with_name(root.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    previous = _manifest(root).get('state')
+
+    conn = db.connect(db_path)
+    conn.execute("BEGIN")   # every table read from the same database state
+    state = _state(conn)
+
+    changed = None          # partition values per table, None: export everything
+    if previous and not full:
+        last_id, count = previous['matches']
+        new_rows = conn.execute("SELECT COUNT(*) FROM matches WHERE id > ?", (last_id,)).fetchone()[0]
+        if state['matches'][1] == count + new_rows:
+            changed = {}
+            for table in ('matches', 'player_matches'):
+                spec = TABLES[table]
+                changed[table] = [v for (v,) in conn.execute(
+                    f"SELECT DISTINCT {spec['partition'][1]} FROM {table} WHERE {spec['id']} > ?", (last_id,))]
+
+    rows = 0
+    for table in ('matches', 'player_matches'):
+        if changed is None or changed[table]:
+            rows += _export(conn, table, tmp / table, None if changed is None else changed[table])
+    if changed is None or state['current_ratings'] != previous['current_ratings']:
+        rows += _export(conn, 'current_ratings', tmp / 'current_ratings')
+    conn.rollback()
+    conn.close()
+
+    for table in ('matches', 'player_matches'):
+        if changed is None:
+            _replace(tmp / table, root / table)
+            continue
+        key = TABLES[table]['partition'][0]
+        for v in changed[table]:
+            _replace(tmp / table / f'{key}={v}', root / table / f'{key}={v}')
+    if (tmp / 'current_ratings').exists():
+        _replace(tmp / 'current_ratings', root / 'current_ratings')
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    manifest = {'state': state, 'refreshed_at': datetime.now().isoformat(timespec='seconds')}
+    (root / 'manifest.json').write_text(json.dumps(manifest))
+    return {'full': changed is None, 'partitions': changed, 'rows': rows, 'seconds': time.perf_counter() - started}
+
+
+def refresh_if_present(db_path=DB_PATH):
+    """Called after scrapes: keeps an existing snapshot current, never creates one."""
+    if exists(db_path):
+        return refresh(db_path)
+    return None
+
+
+def read(db_path, table, columns=None, filters=None):
+    """Memory-mapped read of one snapshot table as an Arrow table; `filters` are pushed down to the files."""
+    return pq.read_table(snapshot_dir(db_path) / table, columns=columns, filters=filters, memory_map=True)
+
+
+def load_player_matches(db_path, conn, player, start=None, end=None):
+    """A player's matches, optionally within [start, end], shaped like analysis' player frames."""
+    row = conn.execute("SELECT id FROM players WHERE name = ?", (player,)).fetchone()
+    player_id = row[0] if row else -1
+    filters = [('bucket', '=', player_id % PLAYER_BUCKETS), ('player_id', '=', player_id)]
+    if start is not None:
+        filters.append(('match_date', '>=', start))
+    if end is not None:
+        filters.append(('match_date', '<=', end))
+    table = read(db_path, 'player_matches', columns=list(PLAYER_FRAME), filters=filters)
+    df = table.to_pandas(date_as_object=False).rename(columns=PLAYER_FRAME)
+    df["is_3set"] = df["set3_floris"].notna()
+    return df.sort_values("match_date", kind="stable").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export matches to a partitioned Parquet snapshot.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--full", action="store_true", help="export everything, not only what changed")
+    args = parser.parse_args()
+
+    result = refresh(args.db, full=args.full)
+    scope = 'volledig' if result['full'] else f"partities {result['partitions']}"
+    print(f"Snapshot {snapshot_dir(args.db)} ververst ({scope}): {result['rows']} rijen in {result['seconds']:.1f}s")
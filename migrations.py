@@ -0,0 +1,204 @@
+from pathlib import Path
+
+DB_PATH = 'matches.db'
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def migrate_match_key(conn) -> int:
+    """
+        Adds the canonical `match_key` column to `matches` with a UNIQUE index
+        on it, then lets remove_dups fill it for old rows, dropping the ones
+        that turn out to be duplicates (keeping the lowest id). Safe to run
+        more than once; returns the number of duplicate rows removed.
+    """
+    if 'match_key' not in _columns(conn, 'matches'):
+        conn.execute("ALTER TABLE matches ADD COLUMN match_key TEXT")
+    with conn:
+        # NULLs never clash, so the index can go on before the keys are filled
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_match_key ON matches(match_key)")
+
+    if not conn.execute("SELECT 1 FROM matches WHERE match_key IS NULL LIMIT 1").fetchone():
+        return 0
+    import remove_dups
+    return len(remove_dups.dedupe(conn, verbose=False)['removed'])
+
+
+def migrate_players(conn) -> int:
+    """
+        Moves player names into the `players` table and gives matches and
+        current_ratings integer keys into it, with (player, date) indexes so
+        per-player lookups become index seeks. The name columns stay for
+        readability. Safe to run more than once; returns the number of
+        players added.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS players (
+            id        INTEGER PRIMARY KEY,
+            name      TEXT UNIQUE,
+            member_nr TEXT
+        )
+    ''')
+    for table, column in (('matches', 'player1_id'), ('matches', 'player2_id'),
+                          ('matches', 'winner_id'), ('current_ratings', 'player_id')):
+        if column not in _columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER REFERENCES players(id)")
+
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_matches_p1_date ON matches(player1_id, match_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_matches_p2_date ON matches(player2_id, match_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_current_ratings_player ON current_ratings(player_id, date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_players_member_nr ON players(member_nr)")
+
+    # cheap index lookups: only an old database has rows without player ids
+    pending = (
+        conn.execute("SELECT 1 FROM matches WHERE player1_id IS NULL LIMIT 1").fetchone()
+        or conn.execute("SELECT 1 FROM current_ratings WHERE player_id IS NULL LIMIT 1").fetchone()
+    )
+    if not pending:
+        return 0
+
+    with conn:
+        before = conn.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+        conn.execute('''
+            INSERT OR IGNORE INTO players (name)
+            SELECT player1 FROM matches WHERE player1 IS NOT NULL
+            UNION SELECT player2 FROM matches WHERE player2 IS NOT NULL
+            UNION SELECT name FROM current_ratings WHERE name IS NOT NULL
+        ''')
+        added = conn.execute("SELECT COUNT(*) FROM players").fetchone()[0] - before
+
+        conn.execute('''
+            UPDATE matches SET
+                player1_id = (SELECT id FROM players WHERE name = matches.player1),
+                player2_id = (SELECT id FROM players WHERE name = matches.player2),
+                winner_id  = (SELECT id FROM players WHERE name = matches.winner)
+             WHERE player1_id IS NULL OR player2_id IS NULL
+        ''')
+        conn.execute('''
+            UPDATE current_ratings SET player_id = (SELECT id FROM players WHERE name = current_ratings.name)
+             WHERE player_id IS NULL
+        ''')
+        if 'scraped_seasons' in _tables(conn):
+            conn.execute('''
+                UPDATE players SET member_nr = (
+                    SELECT s.member_nr FROM scraped_seasons s
+                     WHERE s.player_name = players.name AND s.member_nr GLOB '[0-9]*'
+                     LIMIT 1)
+                 WHERE member_nr IS NULL
+            ''')
+    return added
+
+
+# one row per side of a match, from that player's point of view; {r} is the
+# matches row (NEW inside a trigger), {a}/{b} the side and its opponent
+_PLAYER_MATCH_ROW = '''
+    INSERT OR REPLACE INTO player_matches
+        (match_id, player_id, match_date, opponent_id, self_name, opp_name, self_rating, opp_rating,
+         set1_self, set1_opp, set2_self, set2_opp, set3_self, set3_opp, won)
+    SELECT {r}.id, {r}.player{a}_id, {r}.match_date, {r}.player{b}_id,
+           {r}.player{a}, {r}.player{b}, {r}.rating{a}, {r}.rating{b},
+           {r}.set1_p{a}, {r}.set1_p{b}, {r}.set2_p{a}, {r}.set2_p{b}, {r}.set3_p{a}, {r}.set3_p{b},
+           COALESCE({r}.winner = {r}.player{a}, 0)
+    {source} WHERE {r}.player{a}_id IS NOT NULL;
+'''
+_MATCH_COLUMNS = ('player1, rating1, player2, rating2, set1_p1, set1_p2, set2_p1, set2_p2, '
+                  'set3_p1, set3_p2, winner, match_date, player1_id, player2_id, winner_id')
+
+
+def _player_match_rows(r, source=''):
+    return [_PLAYER_MATCH_ROW.format(r=r, a=a, b=b, source=source) for a, b in ((1, 2), (2, 1))]
+
+
+def migrate_player_matches(conn) -> int:
+    """
+        Creates `player_matches`, every match stored twice, once from each
+        player's side, so a player's history is one range read on
+        (player_id, match_date) without flipping columns afterwards. Triggers
+        on `matches` keep it in sync; an existing database is filled once.
+        Returns the number of rows added by that fill.
+    """
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS player_matches (
+                id          INTEGER PRIMARY KEY,
+                match_id    INTEGER NOT NULL,
+                player_id   INTEGER NOT NULL,
+                match_date  DATE,
+                opponent_id INTEGER,
+                self_name   TEXT,
+                opp_name    TEXT,
+                self_rating REAL,
+                opp_rating  REAL,
+                set1_self INTEGER, set1_opp INTEGER,
+                set2_self INTEGER, set2_opp INTEGER,
+                set3_self INTEGER, set3_opp INTEGER,
+                won         INTEGER
+            )
+        ''')
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_player_matches_match ON player_matches(match_id, player_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_player_matches_player_date ON player_matches(player_id, match_date)")
+        on_insert = ''.join(_player_match_rows('NEW'))
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_matches_insert AFTER INSERT ON matches BEGIN {on_insert} END")
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_matches_delete AFTER DELETE ON matches
+            BEGIN DELETE FROM player_matches WHERE match_id = OLD.id; END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_matches_update AFTER UPDATE OF {_MATCH_COLUMNS} ON matches
+            BEGIN DELETE FROM player_matches WHERE match_id = OLD.id; {on_insert} END
+        ''')
+
+    if (conn.execute("SELECT 1 FROM player_matches LIMIT 1").fetchone()
+            or not conn.execute("SELECT 1 FROM matches LIMIT 1").fetchone()):
+        return 0
+    with conn:
+        for statement in _player_match_rows('matches', 'FROM matches'):
+            conn.execute(statement)
+    return conn.execute("SELECT COUNT(*) FROM player_matches").fetchone()[0]
+
+
+def migrate_player_totals(conn) -> int:
+    """
+        Creates `player_totals`, running per-player counters that triggers on
+        player_matches keep current within the transaction of every match
+        insert or delete. An existing database is counted once; returns the
+        number of players counted.
+    """
+    import player_totals
+    with conn:
+        conn.execute(player_totals.TABLE)
+        for trigger in player_totals.triggers():
+            conn.execute(trigger)
+
+    if (conn.execute("SELECT 1 FROM player_totals LIMIT 1").fetchone()
+            or not conn.execute("SELECT 1 FROM player_matches LIMIT 1").fetchone()):
+        return 0
+    return player_totals.rebuild(conn)['players']
+
+
+def migrate(conn):
+    return {
+        'match_key_duplicates_removed': migrate_match_key(conn),
+        'players_added': migrate_players(conn),
+        'player_matches_added': migrate_player_matches(conn),
+        'player_totals_added': migrate_player_totals(conn),
+    }
+
+
+if __name__ == "__main__":
+    if not Path(DB_PATH).exists():
+        raise SystemExit(f"{DB_PATH} not found, nothing to migrate")
+    import db
+    conn = db.connect(DB_PATH)
+    conn.executescript(db.SCHEMA)
+    result = migrate(conn)
+    conn.close()
+    for step, value in result.items():
+        print(f"{step}: {value}")
@@ -0,0 +1,170 @@
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import db
+
+ARCHIVE_DIR = 'archive'
+DB_PATH = db.DB_PATH
+KINDS = {1: 'singles', 2: 'doubles'}
+
+
+class PageArchive:
+    """
+        Content-addressed store of fetched rating pages. Every page is written
+        once, gzip-compressed, under objects/<sha[:2]>/<sha>.html.gz; index.jsonl
+        records which player, season and kind (singles/doubles) it belongs to.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = Path(root)
+        self.objects = self.root / 'objects'
+        self.index_path = self.root / 'index.jsonl'
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _object_path(self, sha):
+        return self.objects / sha[:2] / f'{sha}.html.gz'
+
+    def put(self, html, member_nr, season, kind='singles', profile=False, fetched_at=None) -> str:
+        data = html.encode('utf-8')
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._object_path(sha)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(f'.tmp{threading.get_ident()}')
+            tmp.write_bytes(gzip.compress(data, compresslevel=6))
+            tmp.replace(path)
+
+        entry = {
+            'member_nr': str(member_nr),
+            'season': season,
+            'kind': kind,
+            'profile': profile,
+            'sha256': sha,
+            'fetched_at': fetched_at or datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock, open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        return sha
+
+    def get(self, sha) -> str:
+        return gzip.decompress(self._object_path(sha).read_bytes()).decode('utf-8')
+
+    def entries(self, kind=None):
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if kind is None or entry['kind'] == kind:
+                        yield entry
+
+
+# players row `p` is the member `member` (a column) the archive files pages under:
+# the member number, or the name for players crawled by name
+_IS_MEMBER = """(p.member_nr = {m} OR p.name = {m}
+                 OR p.name IN (SELECT player_name FROM scraped_seasons WHERE member_nr = {m}))"""
+
+
+def unarchived(conn, archive, kind='singles') -> dict:
+    """
+        What a replay would lose: the scraped_seasons pages with no archived
+        copy, the number of stored matches in which neither player is a
+        member the archive has pages of, and the number of current_ratings
+        rows without an archived profile page of that player from that day
+        (e.g. anything scraped without --archive).
+    """
+    entries = list(archive.entries(kind))
+    archived = {(e['member_nr'], e['season']) for e in entries}
+    pages = [(m, s) for m, s in conn.execute("SELECT member_nr, season FROM scraped_seasons ORDER BY member_nr, season")
+             if (m, s) not in archived]
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_members (member_nr TEXT PRIMARY KEY)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_profiles (member_nr TEXT, day TEXT, PRIMARY KEY (member_nr, day))")
+    conn.execute("DELETE FROM archived_members")
+    conn.execute("DELETE FROM archived_profiles")
+    conn.executemany("INSERT OR IGNORE INTO archived_members VALUES (?)", [(m,) for m, _ in archived])
+    # replay stores a profile page's rating under the day it was fetched
+    conn.executemany("INSERT OR IGNORE INTO archived_profiles VALUES (?, ?)",
+                     [(e['member_nr'], e['fetched_at'][:10]) for e in entries if e['profile']])
+    matches = conn.execute(f'''
+        SELECT COUNT(*) FROM matches m
+         WHERE NOT EXISTS (
+               SELECT 1 FROM players p JOIN archived_members a ON {_IS_MEMBER.format(m='a.member_nr')}
+                WHERE p.id IN (m.player1_id, m.player2_id))
+    ''').fetchone()[0]
+    ratings = conn.execute(f'''
+        SELECT COUNT(*) FROM current_ratings r
+         WHERE NOT EXISTS (
+               SELECT 1 FROM players p JOIN archived_profiles a ON {_IS_MEMBER.format(m='a.member_nr')}
+                WHERE p.id = r.player_id AND a.day = r.date)
+    ''').fetchone()[0]
+    conn.execute("DROP TABLE archived_members")
+    conn.execute("DROP TABLE archived_profiles")
+    return {'pages': pages, 'matches': matches, 'ratings': ratings}
+
+
+def replay(archive, db_path=DB_PATH, kind='singles', force=False) -> dict:
+    """
+        Rebuilds `matches` and `current_ratings` from the archived pages,
+        without a browser: both tables are emptied and every archived page
+        is parsed and inserted again. Refuses, unless `force`, when stored
+        data has no archived page to come back from (see unarchived()).
+    """
+    import player_rating_progression_scrape as scrape
+
+    started = time.perf_counter()
+    conn = db.connect(db_path)
+    c = conn.cursor()
+    db.init_schema(conn)
+    missing = unarchived(conn, archive, kind)
+    if (missing['pages'] or missing['matches'] or missing['ratings']) and not force:
+        conn.close()
+        print(f"{len(missing['pages'])} opgeslagen seizoenen, {missing['matches']} wedstrijden en "
+              f"{missing['ratings']} ratings staan niet in het archief en zouden verloren gaan; "
+              f"gebruik --force om toch opnieuw in te lezen")
+        return {'pages': 0, 'matches': 0, 'seconds': 0.0, 'refused': True, 'unarchived': missing}
+    with conn:
+        c.execute("DELETE FROM matches")
+        c.execute("DELETE FROM current_ratings")
+
+    pages = inserted = 0
+    seen = set()
+    for entry in sorted(archive.entries(kind), key=lambda e: e['fetched_at']):
+        # the same unchanged page fetched twice on one day counts once
+        fetched_day = entry['fetched_at'][:10]
+        if (entry['sha256'], fetched_day) in seen:
+            continue
+        seen.add((entry['sha256'], fetched_day))
+
+        html = archive.get(entry['sha256'])
+        if entry['profile']:
+            inp = 1 if kind == 'singles' else 2
+            scrape.storeCurrentRating(html, c, conn, inp, day=fetched_day)
+        inserted += scrape.insertDB(html, c, conn)
+        pages += 1
+
+    conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"{pages} pagina's opnieuw ingelezen, {inserted} wedstrijden in {elapsed:.1f}s")
+    return {'pages': pages, 'matches': inserted, 'seconds': elapsed, 'refused': False, 'unarchived': missing}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild matches/current_ratings from the page archive.")
+    parser.add_argument("command", choices=["replay"])
+    parser.add_argument("--archive", default=ARCHIVE_DIR)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--kind", default='singles', choices=list(KINDS.values()))
+    parser.add_argument("--force", action="store_true",
+                        help="replay even when stored seasons or matches have no archived page; those are lost")
+    args = parser.parse_args()
+
+    if replay(PageArchive(args.archive), db_path=args.db, kind=args.kind, force=args.force)['refused']:
+        raise SystemExit(1)
@@ -3,16 +3,34 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
-import re
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 import time
 from datetime import datetime
 from datetime import date
 import json
+import os
 from pathlib import Path
-import sqlite3
 import matplotlib.pyplot as plt
 from analysis import generate_rating_plot_html
+import match_parser
+import match_snapshot
+import db
+import page_archive
+import player_totals
+import scrape_metrics
+import scrape_pipeline
+from scrape_metrics import ScrapeMetrics
+
+# readiness waits: how long a single wait may take and how often it polls the DOM
+READY_TIMEOUT = 10
+READY_POLL = 0.25
+# a season without matches counts as loaded once its tab and the empty list held this long
+EMPTY_SETTLE = 1.0
+# what to do when a readiness wait times out: 'continue' goes on with the page
+# as it is, 'raise' aborts the scrape
+ON_TIMEOUT = 'continue'
+# HTML parser used by insertDB, None picks the fastest installed backend (see match_parser)
+PARSER_BACKEND = None
 
 
 def playerLookup(nr, driver):
@@ -60,88 +78,135 @@ def MoreDetails(input, wait):
 
 
 
-def getPageContent(driver):
-    time.sleep(5)
-    html_content = driver.page_source
+def waitFor(driver, condition, what, timeout=READY_TIMEOUT):
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=READY_POLL,
+                             ignored_exceptions=(StaleElementReferenceException,)).until(condition)
+    except TimeoutException:
+        scrape_metrics.incr('wait_timeouts')
+        if ON_TIMEOUT == 'raise':
+            raise
+        print(f'Geen {what} na {timeout}s, ga verder met de huidige pagina')
+        return None
 
-    soup = BeautifulSoup(html_content, 'html.parser')
 
-    return soup
+def matchesStable(empty_settle=EMPTY_SETTLE):
+    # ready once the match list has the same size and the same active season on two consecutive
+    # polls; an empty list only after it stayed empty for empty_settle seconds, as matches can still load
+    last = {'state': None, 'since': None}
 
+    def condition(driver):
+        state = (len(driver.find_elements(By.CSS_SELECTOR, 'li.match-group__item')), activePill(driver))
+        now = time.monotonic()
+        if state != last['state']:
+            last['state'], last['since'] = state, now
+            return False
+        count, pill = state
+        return count > 0 or (pill is not None and now - last['since'] >= empty_settle)
 
-def insertDB(soup, c, conn):
-    matches = soup.find_all('li', class_='match-group__item')
+    return condition
 
-    for item in matches:
-        # 3a. Check for scores: if empty, skip (match not played)
-        point_lists = item.select('.match__result .points')
-        if not point_lists:
-            continue
 
-        # 3b. Parse players + ratings
-        def parse_player(span):
-            name = span.find('span', class_='nav-link__value').get_text(strip=True)
-            m = re.search(r'\(([\d,\.]+)\)', span.get_text())
-            rating = float(m.group(1).replace(',', '.')) if m else None
-            return name, rating
-
-        rows = item.select('.match__row-title-value-content')
-        p1, r1 = parse_player(rows[0])
-        p2, r2 = parse_player(rows[1])
-
-        # 3c. Parse sets (now up to 3)
-        scores = []
-        for ul in point_lists:
-            nums = [int(li.get_text(strip=True)) for li in ul.select('.points__cell')]
-            scores.append(nums)
-        # pad to 3 sets
-        while len(scores) < 3:
-            scores.append([None, None])
-        (set1_p1, set1_p2), (set2_p1, set2_p2), (set3_p1, set3_p2) = scores
-
-        # 3d. Determine winner
-        win_span = item.select_one('.match__row.has-won .nav-link__value')
-        winner = win_span.get_text(strip=True) if win_span else None
-
-        # 3e. Parse date
-        date_elem = item.select_one('.match__footer .icon-clock + .nav-link__value')
-        if date_elem:
-            date_text = date_elem.get_text(strip=True)
-            # strip off weekday (“za 10-5-2025” → “10-5-2025”)
-            date_part = date_text.split(' ', 1)[1]
-            match_date = datetime.strptime(date_part, '%d-%m-%Y').date()
-        else:
-            match_date = None
-
-        dup = c.execute('''
-                    SELECT 1 FROM matches
-                     WHERE player1 = ?
-                       AND player2 = ?
-                       AND set1_p1 = ? AND set1_p2 = ?
-                       AND set2_p1 = ? AND set2_p2 = ?
-                       AND set3_p1 = ? AND set3_p2 = ?
-                ''', (
-            p1, p2,
-            set1_p1, set1_p2,
-            set2_p1, set2_p2,
-            set3_p1, set3_p2
-        )).fetchone()
-        if dup:
-            continue
+def activePill(driver):
+    pills = driver.find_elements(By.CSS_SELECTOR, 'ul.page-nav--pills li.page-nav__item--active')
+    return pills[0].get_attribute('textContent').strip() if pills else None
 
-        # --- 4. Insert into DB ---
-        c.execute('''
-                    INSERT INTO matches
+
+def getPageContent(driver, timeout=READY_TIMEOUT):
+    """(html, ready): ready is False when the match list did not settle within `timeout`."""
+    with scrape_metrics.span('page_ready'):
+        ready = waitFor(driver, matchesStable(), 'stabiele wedstrijdlijst', timeout) is not None
+        html_content = driver.page_source
+    scrape_metrics.incr('pages_fetched')
+
+    return html_content, ready
+
+
+def playerIds(names, c):
+    """Maps player names to their players.id, adding the players not seen before."""
+    names = sorted({n for n in names if n})
+    c.executemany("INSERT OR IGNORE INTO players (name) VALUES (?)", [(n,) for n in names])
+    ids = {}
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        ids.update((name, pid) for pid, name in c.execute(
+            f"SELECT id, name FROM players WHERE name IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    return ids
+
+
+def insertMatches(records, c, conn):
+    """
+        Inserts the matches of one page in a single transaction. Matches that
+        are already stored are skipped by the UNIQUE index on match_key.
+        Returns the number of new rows.
+    """
+    with scrape_metrics.span('db_insert'), conn:
+        ids = playerIds([n for m in records for n in (m.player1, m.player2)], c)
+        rows = [
+            (*m, match_parser.record_key(m), ids.get(m.player1), ids.get(m.player2), ids.get(m.winner))
+            for m in records
+        ]
+        c.executemany('''
+                    INSERT OR IGNORE INTO matches
                     (player1, rating1, player2, rating2,
                      set1_p1, set1_p2, set2_p1, set2_p2,
                      set3_p1, set3_p2,
-                     winner, match_date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (p1, r1, p2, r2,
-                      set1_p1, set1_p2, set2_p1, set2_p2,
-                      set3_p1, set3_p2,
-                      winner, match_date))
-        conn.commit()
+                     winner, match_date, match_key,
+                     player1_id, player2_id, winner_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+        # rowcount leaves out the rows the player_matches/player_totals triggers wrote
+        inserted = max(c.rowcount, 0)
+        # the triggers updated player_totals; recount the streaks this page put out of order
+        player_totals.settle(c, ids.values())
+    scrape_metrics.incr('rows_inserted', inserted)
+    scrape_metrics.incr('duplicates_skipped', len(rows) - inserted)
+    return inserted
+
+
+def parseMatches(html, backend=None):
+    with scrape_metrics.span('parse'):
+        records = match_parser.parse_matches(html, backend or PARSER_BACKEND)
+    scrape_metrics.incr('matches_parsed', len(records))
+    return records
+
+
+def insertDB(html, c, conn, backend=None):
+    return insertMatches(parseMatches(html, backend), c, conn)
+
+
+def storeSeason(html, member_nr, player_name, season, complete, c, conn):
+    """
+        Stores the matches of one season tab and records it in scraped_seasons.
+        Only past seasons are marked complete; the current one keeps changing.
+    """
+    records = parseMatches(html)
+    inserted = insertMatches(records, c, conn)
+    recordSeason(records, member_nr, player_name, season, complete, c, conn)
+    return inserted
+
+
+def recordSeason(records, member_nr, player_name, season, complete, c, conn):
+    dates = [m.match_date for m in records if m.match_date]
+    with conn:
+        c.execute('''
+            INSERT OR REPLACE INTO scraped_seasons
+            (member_nr, season, player_name, complete, newest_match, matches, scraped_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (str(member_nr), season, player_name, int(complete),
+              max(dates) if dates else None, len(records), datetime.now().isoformat(timespec='seconds')))
+
+
+def completeSeasons(member_nr, c):
+    rows = c.execute(
+        "SELECT season FROM scraped_seasons WHERE member_nr = ? AND complete = 1", (str(member_nr),)
+    ).fetchall()
+    return {season for (season,) in rows}
+
+
+def seasonLabel(year):
+    return year.get_attribute('textContent').strip()
 
 
 def otherYears(wait):
@@ -172,81 +237,188 @@ def MoreYears(wait):
     toggle = more_li.find_element(By.CSS_SELECTOR, "span.js-toggle-dropdown")
     toggle.click()
 
-    #  (optionally wait a tiny bit for any animation)
-    time.sleep(0.5)
-
     # 3️⃣ Now, from that same <li>, find its dropdown-items
-    dropdown_items = more_li.find_elements(
-        By.CSS_SELECTOR,
-        "ul.page-nav--more li.js-page-nav__item.page-nav__item"
-    )
+    item_selector = "ul.page-nav--more li.js-page-nav__item.page-nav__item"
+    waitFor(more_li.parent,
+            lambda _: any(li.is_displayed() for li in more_li.find_elements(By.CSS_SELECTOR, item_selector)),
+            'uitgeklapt jarenmenu')
+    dropdown_items = more_li.find_elements(By.CSS_SELECTOR, item_selector)
 
     return dropdown_items[:5]
 
 def Quit(driver):
-    driver.quit()
+    try:
+        driver.quit()
+    except Exception as e:
+        # a session that already died; the profile lock is released all the same
+        print(f'Browser afsluiten mislukt: {e!r}')
+    finally:
+        if getattr(driver, 'profile_lock', None) is not None:
+            driver.profile_lock.close()
 
 
 def switchTab(year):
+    """Opens a season tab; False when the page still showed the previous season after the wait."""
+    driver = year.parent
+    previous = activePill(driver)
+    old_matches = driver.find_elements(By.CSS_SELECTOR, 'li.match-group__item')
+
     tab_link = year.find_element(By.TAG_NAME, 'a')
 
     tab_link.click()
 
-    time.sleep(2)
+    # the tab has switched once the active pill changed or the old match list is gone
+    return waitFor(driver,
+                   lambda d: activePill(d) != previous or (old_matches and EC.staleness_of(old_matches[0])(d)),
+                   'nieuw seizoen') is not None
 
-def currentRating(soup, inp):
-    ratings = soup.find_all("span", class_="tag-duo__value")
+def currentRating(header, inp):
     if inp == 1:
-        rating = ratings[0].text
+        rating = header.ratings[0]
     else:
-        rating = ratings[1].text
+        rating = header.ratings[1]
     return rating
 
-def main(name):
-    inp = 1
-    max_years = 8
-
-    webdriver_path = "chromedriver-mac-arm64/chromedriver"
-
-    service = Service(webdriver_path)
-    driver = webdriver.Chrome(service=service)
+START_URL = "https://mijnknltb.toernooi.nl/player-profile/34b4ec17-e82a-425c-8e33-8b79e4dbf5ff/Rating"
+WEBDRIVER_PATH = "chromedriver-mac-arm64/chromedriver"
+# consent state that survives between runs
+CHROME_PROFILE_DIR = "chrome-profile"
+COOKIE_JAR = "cookies.json"
 
-    wait = WebDriverWait(driver, 10)
+try:
+    import fcntl
+except ImportError:             # Windows: no advisory locks, every process gets its own profile
+    fcntl = None
 
-    url = "https://mijnknltb.toernooi.nl/player-profile/34b4ec17-e82a-425c-8e33-8b79e4dbf5ff/Rating"
-    driver.get(url)
 
-    data = []
+def storeCurrentRating(html, c, conn, inp=1, day=None):
+    header = match_parser.parse_profile(html)
+    player_name = header.name
+    print(f'Data verzamelen voor {player_name}... \n')
+    current_rating = currentRating(header, inp)
+    today_str = day or date.today().strftime("%Y-%m-%d")
 
-    conn = sqlite3.connect('matches.db')
-    c = conn.cursor()
+    rating_val = float(current_rating.replace(',', '.'))
+    player_id = playerIds([player_name], c)[player_name]
     c.execute('''
-        CREATE TABLE IF NOT EXISTS matches (
-            id INTEGER PRIMARY KEY,
-            player1 TEXT,
-            rating1 REAL,
-            player2 TEXT,
-            rating2 REAL,
-            set1_p1 INTEGER,
-            set1_p2 INTEGER,
-            set2_p1 INTEGER,
-            set2_p2 INTEGER,
-            set3_p1 INTEGER,
-            set3_p2 INTEGER,
-            winner TEXT,
-            match_date DATE
-        )
-        ''')
+            INSERT INTO current_ratings (name, rating, date, player_id)
+            VALUES (?, ?, ?, ?)
+        ''', (player_name, rating_val, today_str, player_id))
     conn.commit()
+    return player_name
 
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS current_ratings (
-            name   TEXT,
-            rating REAL,
-            date   DATE
-        )
-        ''')
-    conn.commit()
+
+def storeMemberNr(player_name, member_nr, c, conn):
+    # only lookups by member number tell us the number; the crawler searches by name
+    if str(member_nr).isdigit():
+        c.execute("UPDATE players SET member_nr = ? WHERE name = ?", (str(member_nr), player_name))
+        conn.commit()
+
+
+def lockProfile(profile_dir):
+    """
+        Claims a Chrome user-data directory for this process, as Chrome will
+        not start on one another browser holds. Returns (directory, lock);
+        the directory is None when another process has it, the lock is
+        released by Quit() or when the process ends.
+    """
+    if fcntl is None:
+        return f"{profile_dir}-{os.getpid()}", None
+    lock = open(f"{Path(profile_dir).resolve()}.lock", 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None, None
+    return profile_dir, lock
+
+
+def startDriver(profile_dir=None):
+    """
+        Starts Chrome on the KNLTB site. With a profile_dir the browser keeps
+        its cookies and consent state in that user-data directory across runs
+        (one directory per concurrently running browser). When another
+        process is using the directory the browser starts without a profile
+        and relies on the cookie jar alone.
+    """
+    options = webdriver.ChromeOptions()
+    lock = None
+    if profile_dir:
+        claimed, lock = lockProfile(profile_dir)
+        if claimed:
+            options.add_argument(f"--user-data-dir={Path(claimed).resolve()}")
+        else:
+            print(f'Profiel {profile_dir} is in gebruik, start zonder profiel (alleen {COOKIE_JAR})')
+    with scrape_metrics.span('driver_start'):
+        service = Service(WEBDRIVER_PATH)
+        try:
+            driver = webdriver.Chrome(service=service, options=options)
+        except Exception:
+            if lock is not None:
+                lock.close()
+            raise
+        driver.profile_lock = lock
+        driver.get(START_URL)
+    return driver
+
+
+def saveCookies(driver, path=COOKIE_JAR):
+    # workers and other processes share the jar: each writes its own temp file
+    tmp = Path(f"{path}.tmp{os.getpid()}-{id(driver)}")
+    tmp.write_text(json.dumps(driver.get_cookies()), encoding="utf-8")
+    tmp.replace(path)
+
+
+def loadCookies(driver, path=COOKIE_JAR):
+    """Puts the non-expired cookies from the jar back into the browser; returns how many."""
+    path = Path(path)
+    if not path.exists():
+        return 0
+    now = time.time()
+    loaded = 0
+    for cookie in json.loads(path.read_text(encoding="utf-8")):
+        if cookie.get('expiry') is not None and cookie['expiry'] <= now:
+            continue
+        if cookie.get('sameSite') not in ('Strict', 'Lax', 'None'):
+            cookie.pop('sameSite', None)
+        try:
+            driver.add_cookie(cookie)
+            loaded += 1
+        except Exception:
+            # cookies for another domain or with attributes Chrome refuses
+            continue
+    if loaded:
+        driver.refresh()
+    return loaded
+
+
+def consentNeeded(driver, timeout=READY_TIMEOUT):
+    # whichever shows up first: the consent banner or the (usable) search toggle
+    waitFor(driver, EC.any_of(
+        EC.presence_of_element_located((By.CLASS_NAME, 'js-show-purposes')),
+        EC.element_to_be_clickable((By.CSS_SELECTOR, 'label[for="MastheadSearchInput"]')),
+    ), 'zoekbalk of cookiemelding', timeout)
+    return any(el.is_displayed() for el in driver.find_elements(By.CLASS_NAME, 'js-show-purposes'))
+
+
+def ensureConsent(wait, driver, cookie_jar=COOKIE_JAR):
+    """
+        Restores the saved cookies and only runs the consent flow when the
+        site still asks for it; the resulting cookies are saved for next time.
+        Returns True when the consent flow had to run.
+    """
+    with scrape_metrics.span('consent'):
+        if cookie_jar:
+            loadCookies(driver, cookie_jar)
+        if not consentNeeded(driver):
+            return False
+        acceptConsent(wait, driver)
+        if cookie_jar:
+            saveCookies(driver, cookie_jar)
+    return True
+
+
+def acceptConsent(wait, driver):
     handleCookies(wait, driver)
     # 1. wait for the consent iframe to appear
     consent_iframe = WebDriverWait(driver, 10).until(
@@ -270,49 +442,113 @@ def main(name):
     # 4. switch back to the main page
     driver.switch_to.default_content()
 
-    # for name in [28690818, 30209986, 31348750, 28655087, 30502160, 28244672, 27329429]:
 
-    playerLookup(name, driver)
-    MoreDetails(inp, wait)
-    soup = getPageContent(driver)
-    media_snippet = soup.find('div', class_='media')
-    player_name = media_snippet.find('span', class_='nav-link__value').text
-    print(f'Data verzamelen voor {player_name}... \n')
-    current_rating = currentRating(soup, inp)
-    today_str = date.today().strftime("%Y-%m-%d")
-    data.append({'date': today_str, 'rating': current_rating})
+def scrapePlayer(name, driver, wait, c, conn, inp=1, max_years=8, incremental=False, archive=None,
+                 pipeline=None):
+    """
+        Scrapes the rating pages of one player into the database, using an
+        already running driver on which the consent flow has been handled.
+        With incremental=True only the current season and seasons that were
+        never fully stored are opened. Every fetched page is also written to
+        `archive` (a page_archive.PageArchive) when given. With a `pipeline`
+        (scrape_pipeline.PagePipeline) pages are handed off for parsing and
+        storing while the browser moves on to the next tab. Returns the
+        player name as shown on the profile.
+    """
+    kind = page_archive.KINDS[inp]
+
+    def storeTab(season, switched):
+        # a tab that did not switch still shows the previous season: nothing to store under this label;
+        # one whose list did not settle is stored but not marked complete, so incremental runs reopen it
+        if not switched:
+            print(f'Seizoen {season} niet geopend, volgende keer opnieuw')
+            return
+        with scrape_metrics.span('more_details'):
+            MoreDetails(inp, wait)
+        html, ready = getPageContent(driver)
+        store(html, season, ready)
+
+    def store(html, season, complete, profile=False):
+        if archive is not None:
+            archive.put(html, name, season, kind, profile=profile)
+        if pipeline is not None:
+            pipeline.submit(html, name, player_name, season, complete)
+        else:
+            storeSeason(html, name, player_name, season, complete, c, conn)
 
-    rating_val = float(current_rating.replace(',', '.'))
-    c.execute('''
-            INSERT INTO current_ratings (name, rating, date)
-            VALUES (?, ?, ?)
-        ''', (player_name, rating_val, today_str))
-    conn.commit()
+    with scrape_metrics.span('player_lookup'):
+        playerLookup(name, driver)
+    with scrape_metrics.span('more_details'):
+        MoreDetails(inp, wait)
+    html, _ = getPageContent(driver)
+    player_name = storeCurrentRating(html, c, conn, inp)
+    storeMemberNr(player_name, name, c, conn)
 
-    insertDB(soup, c, conn)
+    store(html, activePill(driver), False, profile=True)
+    done = completeSeasons(name, c) if incremental else set()
     other_years = otherYears(wait)
     years = 1
 
     for year in other_years:
         if years > max_years:
             break
-        switchTab(year)
-        MoreDetails(inp, wait)
-        soup = getPageContent(driver)
-        insertDB(soup, c, conn)
+        season = seasonLabel(year)
         years+= 1
+        if season in done:
+            continue
+        with scrape_metrics.span('switch_tab'):
+            switched = switchTab(year)
+        storeTab(season, switched)
 
-    extra_years = MoreYears(wait)
-    toggle(wait)
+    with scrape_metrics.span('more_years'):
+        extra_years = MoreYears(wait)
+        toggle(wait)
     for year in extra_years:
         if years > max_years:
             break
-        toggle(wait)
-        switchTab(year)
-        MoreDetails(inp, wait)
-        soup = getPageContent(driver)
-        insertDB(soup, c, conn)
+        season = seasonLabel(year)
         years+=1
-
-    conn.close()
-    Quit(driver)
+        if season in done:
+            continue
+        with scrape_metrics.span('switch_tab'):
+            toggle(wait)
+            switched = switchTab(year)
+        storeTab(season, switched)
+
+    return player_name
+
+
+def main(name, incremental=False, archive_dir=None, metrics_path=scrape_metrics.METRICS_JSONL,
+         prom_path=scrape_metrics.METRICS_PROM):
+    metrics = ScrapeMetrics(member_nr=str(name))
+    scrape_metrics.activate(metrics)
+    driver = conn = None
+    try:
+        driver = startDriver(CHROME_PROFILE_DIR)
+        wait = WebDriverWait(driver, 10)
+
+        conn = db.connect()
+        c = conn.cursor()
+        db.init_schema(conn)
+        ensureConsent(wait, driver)
+
+        # for name in [28690818, 30209986, 31348750, 28655087, 30502160, 28244672, 27329429]:
+
+        archive = page_archive.PageArchive(archive_dir) if archive_dir else None
+        # parsing and storing run behind the browser, see scrape_pipeline
+        with scrape_pipeline.PagePipeline(db.DB_PATH, metrics=metrics) as pipeline:
+            scrapePlayer(name, driver, wait, c, conn, incremental=incremental, archive=archive,
+                         pipeline=pipeline)
+            error = pipeline.wait(name)
+        if error is not None:
+            raise error
+        match_snapshot.refresh_if_present(db.DB_PATH)
+    finally:
+        # a failed run must not leave Chrome (and its profile lock) or the connection behind
+        if conn is not None:
+            conn.close()
+        if driver is not None:
+            Quit(driver)
+        # also written for failed runs: those are the ones worth looking at
+        scrape_metrics.activate(None)
+        metrics.write(metrics_path, prom_path)
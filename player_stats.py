@@ -0,0 +1,203 @@
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import db
+import match_snapshot
+
+DB_PATH = db.DB_PATH
+SET_COLUMNS = [f"set{i}_{side}" for i in (1, 2, 3) for side in ("floris", "opp")]
+
+# every player's matches from their own side, sorted for the streaks
+PLAYER_FRAME = """
+    SELECT player_id, match_id AS id, match_date, opp_name,
+           self_rating AS floris_rating, opp_rating,
+           set1_self AS set1_floris, set1_opp, set2_self AS set2_floris, set2_opp,
+           set3_self AS set3_floris, set3_opp, won
+      FROM player_matches
+"""
+
+
+def load_player_frame(conn, db_path=DB_PATH, players=None) -> pd.DataFrame:
+    """All players' matches (or those of `players`) as one frame; from the Parquet snapshot when it is current."""
+    if players is None and match_snapshot.is_fresh(conn, db_path):
+        columns = ['player_id'] + [c for c in match_snapshot.PLAYER_FRAME if c != 'self_name']
+        df = match_snapshot.read(db_path, 'player_matches', columns=columns).to_pandas(date_as_object=False)
+        return df.rename(columns=match_snapshot.PLAYER_FRAME)
+    where = ''
+    if players is not None:
+        where = f"WHERE player_id IN ({', '.join('?' * len(players))})"
+    return pd.read_sql_query(
+        f"{PLAYER_FRAME} {where} ORDER BY player_id, match_date",
+        conn, params=list(players or ()), parse_dates=["match_date"], dtype={"won": bool}
+    )
+
+
+def _ratio(num, den, empty=np.nan):
+    num, den = np.asarray(num, dtype="float64"), np.asarray(den, dtype="float64")
+    return np.divide(num, den, out=np.full(len(num), empty), where=den > 0)
+
+
+def grouped_statistics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+        compute_statistics for every player in `df` at once, one row per
+        player_id. Per-match counts are built once for the whole frame and
+        summed per player in a single reduceat; streaks and best/worst
+        opponents are group-wise scans over the same arrays. The dicts of
+        compute_statistics become flat columns (best_beaten and
+        best_beaten_rating, ...); metrics without data are NaN.
+    """
+    df = df.sort_values(["player_id", "match_date"], kind="stable").reset_index(drop=True)
+    pid = df["player_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, pid[1:] != pid[:-1]]) if len(pid) else np.array([], dtype="int64")
+    scores = df[SET_COLUMNS].to_numpy(dtype="float64", na_value=np.nan).reshape(len(df), 3, 2)
+    f, o = scores[:, :, 0], scores[:, :, 1]
+    played = ~np.isnan(f) & ~np.isnan(o)
+    set_won, set_lost = f > o, o > f
+    tb = ((f == 7) & (o == 6)) | ((f == 6) & (o == 7))
+    won = df["won"].to_numpy(dtype=bool)
+    is_3set = ~np.isnan(f[:, 2])
+    own = df["floris_rating"].to_numpy(dtype="float64")
+    opp = df["opp_rating"].to_numpy(dtype="float64")
+
+    per_match = {
+        "matches": np.ones(len(df), dtype="int64"), "won": won,
+        "won_3": won & is_3set, "lost_3": ~won & is_3set,
+        "tb_won": (set_won & tb).sum(axis=1), "tb_lost": (set_lost & tb).sum(axis=1),
+        "dropped1": set_lost[:, 0], "comebacks": set_lost[:, 0] & won,
+        "won1": set_won[:, 0], "converted": set_won[:, 0] & won,
+        "sets_played": played.sum(axis=1), "sets_won": (set_won & played).sum(axis=1),
+        "games_for": np.nansum(f, axis=1), "games_against": np.nansum(o, axis=1),
+        "upsets": opp < own, "upsets_won": (opp < own) & won,
+        "favours": opp >= own, "favours_won": (opp >= own) & won,
+        "straight_won": won & ~is_3set,
+        "close_set_won": ((f == 7) & (o == 5)).sum(axis=1), "close_set_lost": ((f == 5) & (o == 7)).sum(axis=1),
+        "bagels_won": ((f == 6) & (o == 0)).sum(axis=1), "bread_won": ((f == 6) & (o == 1)).sum(axis=1),
+        "bagels_lost": ((o == 6) & (f == 0)).sum(axis=1), "bread_lost": ((o == 6) & (f == 1)).sum(axis=1),
+    }
+    for i in (1, 2, 3):
+        per_match[f"set{i}_played"] = played[:, i - 1]
+        per_match[f"set{i}_won"] = set_won[:, i - 1] & played[:, i - 1]
+    # rows are sorted by player, so one reduceat sums every column per player
+    counts = np.column_stack([np.asarray(v, dtype="float64") for v in per_match.values()])
+    sums = pd.DataFrame(np.add.reduceat(counts, starts, axis=0) if len(pid) else counts,
+                        index=pid[starts], columns=list(per_match))
+    sums = sums.astype({c: "int64" for c in per_match if not c.startswith("games_")})
+
+    out = sums[["matches", "won"]].copy()
+    out["lost"] = sums["matches"] - sums["won"]
+    for col in ("won_3", "lost_3", "tb_won", "tb_lost", "comebacks", "converted", "straight_won",
+                "close_set_won", "close_set_lost", "bagels_won", "bread_won", "bagels_lost", "bread_lost"):
+        out[col] = sums[col]
+    out["comeback_rate"] = _ratio(sums["comebacks"], sums["dropped1"], 0.0)
+    out["conversion_rate"] = _ratio(sums["converted"], sums["won1"], 0.0)
+    out["set_win_pct"] = _ratio(sums["sets_won"], sums["sets_played"], 0.0)
+    out["game_win_pct"] = _ratio(sums["games_for"], sums["games_for"] + sums["games_against"], 0.0)
+    out["upset_win_pct"] = _ratio(sums["upsets_won"], sums["upsets"])
+    out["favoured_win_pct"] = _ratio(sums["favours_won"], sums["favours"])
+    for i in (1, 2, 3):
+        out[f"set{i}_win_pct"] = _ratio(sums[f"set{i}_won"], sums[f"set{i}_played"])
+
+    # longest win streak: runs of wins that restart at every loss and every new player
+    runs = np.cumsum(won)
+    base = np.where(~won, runs, 0)
+    base[starts] = runs[starts] - won[starts]
+    streaks = runs - np.maximum.accumulate(base) if len(pid) else runs
+    out["longest_streak"] = np.maximum.reduceat(streaks, starts) if len(pid) else []
+
+    # best beaten / worst lost to, and the biggest rating gaps either way
+    names = df["opp_name"]
+    diff = own - opp
+    picks = (
+        ("best_beaten", "best_beaten_rating", np.where(won, opp, np.nan), "idxmin", opp),
+        ("worst_lost_to", "worst_lost_to_rating", np.where(~won, opp, np.nan), "idxmax", opp),
+        ("biggest_upset_win", "biggest_upset_win_diff", np.where(won & (diff > 0), diff, np.nan), "idxmax", diff),
+        ("biggest_bad_beat_loss", "biggest_bad_beat_loss_diff", np.where(~won & (-diff > 0), -diff, np.nan), "idxmax", -diff),
+    )
+    for name_col, value_col, values, pick, source in picks:
+        values = pd.Series(values)
+        valid = values.notna().to_numpy()
+        rows = getattr(values[valid].groupby(pid[valid]), pick)()
+        out[name_col] = pd.Series(names.iloc[rows.to_numpy()].to_numpy(), index=rows.index).reindex(out.index)
+        out[value_col] = pd.Series(source[rows.to_numpy()], index=rows.index).reindex(out.index)
+    out["avg_rating_beaten"] = pd.Series(np.where(won, opp, np.nan)).groupby(pid).mean()
+    out["avg_rating_lostto"] = pd.Series(np.where(~won, opp, np.nan)).groupby(pid).mean()
+
+    out.index.name = "player_id"
+    return out
+
+
+def refresh(db_path=DB_PATH, full=False) -> dict:
+    """
+        Recomputes player_stats. Only players with player_matches rows added
+        after the stored watermark are recomputed, unless `full` or the table
+        is empty; deleted matches (dedup, replay) need a full run.
+    """
+    started = time.perf_counter()
+    conn = db.connect(db_path)
+    db.init_schema(conn)
+    previous = conn.execute("SELECT MAX(watermark) FROM player_stats").fetchone()[0]
+    watermark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM player_matches").fetchone()[0]
+
+    players = None
+    if previous is not None and not full:
+        players = [pid for (pid,) in conn.execute(
+            "SELECT DISTINCT player_id FROM player_matches WHERE id > ?", (previous,))]
+        if not players:
+            conn.close()
+            return {'players': 0, 'full': False, 'seconds': time.perf_counter() - started}
+
+    stats = grouped_statistics(load_player_frame(conn, db_path, players))
+    stats["watermark"] = watermark
+    stats["computed_at"] = datetime.now().isoformat(timespec='seconds')
+    stats = stats.reset_index()
+    columns = list(stats.columns)
+    rows = stats.astype(object).where(stats.notna(), None).itertuples(index=False, name=None)
+    with conn:
+        if players is None:
+            conn.execute("DELETE FROM player_stats")
+        conn.executemany(
+            f"INSERT OR REPLACE INTO player_stats ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [tuple(v.item() if isinstance(v, np.generic) else v for v in row) for row in rows],
+        )
+    conn.close()
+    return {'players': len(stats), 'full': players is None, 'seconds': time.perf_counter() - started}
+
+
+def leaderboard(conn, metric='won', limit=20, min_matches=10) -> pd.DataFrame:
+    """Top players on one player_stats column, among players with at least `min_matches` matches."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(player_stats)")]
+    if metric not in columns:
+        raise ValueError(f"unknown metric {metric!r}")
+    return pd.read_sql_query(f'''
+        SELECT p.name, s.matches, s.{metric}
+          FROM player_stats s JOIN players p ON p.id = s.player_id
+         WHERE s.matches >= ? AND s.{metric} IS NOT NULL
+         ORDER BY s.{metric} DESC
+         LIMIT ?
+    ''', conn, params=(min_matches, limit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="League-wide player statistics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("refresh", help="recompute player_stats")
+    run.add_argument("--full", action="store_true", help="recompute every player, not only changed ones")
+    top = sub.add_parser("top", help="show a leaderboard")
+    top.add_argument("metric", nargs="?", default="won")
+    top.add_argument("--limit", type=int, default=20)
+    top.add_argument("--min-matches", type=int, default=10)
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        result = refresh(args.db, args.full)
+        print(f"{result['players']} spelers bijgewerkt ({'volledig' if result['full'] else 'incrementeel'}) "
+              f"in {result['seconds']:.1f}s")
+    else:
+        conn = db.connect(args.db)
+        print(leaderboard(conn, args.metric, args.limit, args.min_matches).to_string(index=False))
+        conn.close()
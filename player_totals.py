@@ -0,0 +1,239 @@
+import argparse
+import time
+
+import db
+
+DB_PATH = db.DB_PATH
+COUNTERS = ('matches', 'won', 'won_3', 'lost_3', 'tb_won', 'tb_lost', 'close_set_won', 'close_set_lost',
+            'bagels_won', 'bread_won', 'bagels_lost', 'bread_lost', 'sets_played', 'sets_won',
+            'games_for', 'games_against', 'first_sets_lost', 'comebacks', 'first_sets_won', 'converted')
+STREAKS = ('current_streak', 'longest_streak', 'first_date', 'last_date')
+
+TABLE = f'''
+    CREATE TABLE IF NOT EXISTS player_totals (
+        player_id    INTEGER PRIMARY KEY,
+        {', '.join(f'{name} INTEGER DEFAULT 0' for name in COUNTERS)},
+        current_streak INTEGER DEFAULT 0,
+        longest_streak INTEGER DEFAULT 0,
+        first_date   DATE,
+        last_date    DATE,
+        streak_dirty INTEGER DEFAULT 0
+    )
+'''
+
+
+def _sets(p, condition):
+    """Sum of `condition` over the three sets of player_matches row `p`; unplayed sets count 0."""
+    return ' + '.join(f"IFNULL({condition(f'{p}.set{i}_self', f'{p}.set{i}_opp')}, 0)" for i in (1, 2, 3))
+
+
+def _score(own, opp):
+    return lambda s, o: f"({s} = {own} AND {o} = {opp})"
+
+
+def counters(p) -> dict:
+    """What one player_matches row `p` (NEW, OLD or a table alias) adds to each counter, as SQL."""
+    lost1, won1 = f"{p}.set1_self < {p}.set1_opp", f"{p}.set1_self > {p}.set1_opp"
+    return {
+        'matches': '1',
+        'won': f"IFNULL({p}.won, 0)",
+        'won_3': f"IFNULL({p}.won AND {p}.set3_self IS NOT NULL, 0)",
+        'lost_3': f"IFNULL(NOT {p}.won AND {p}.set3_self IS NOT NULL, 0)",
+        'tb_won': _sets(p, _score(7, 6)),
+        'tb_lost': _sets(p, _score(6, 7)),
+        'close_set_won': _sets(p, _score(7, 5)),
+        'close_set_lost': _sets(p, _score(5, 7)),
+        'bagels_won': _sets(p, _score(6, 0)),
+        'bread_won': _sets(p, _score(6, 1)),
+        'bagels_lost': _sets(p, _score(0, 6)),
+        'bread_lost': _sets(p, _score(1, 6)),
+        'sets_played': _sets(p, lambda s, o: f"({s} IS NOT NULL AND {o} IS NOT NULL)"),
+        'sets_won': _sets(p, lambda s, o: f"({s} > {o})"),
+        'games_for': _sets(p, lambda s, o: s),
+        'games_against': _sets(p, lambda s, o: o),
+        'first_sets_lost': f"IFNULL({lost1}, 0)",
+        'comebacks': f"IFNULL({lost1} AND {p}.won, 0)",
+        'first_sets_won': f"IFNULL({won1}, 0)",
+        'converted': f"IFNULL({won1} AND {p}.won, 0)",
+    }
+
+
+def triggers() -> list:
+    """
+        Triggers on player_matches, which itself is filled by triggers on
+        matches: every match insert or delete updates the totals of both
+        players inside the same transaction. The streak only extends while
+        matches arrive in date order; anything else (an older season, a
+        delete) marks the row streak_dirty for settle() to recount.
+    """
+    new, old = counters('NEW'), counters('OLD')
+    in_order = "IFNULL(excluded.last_date >= player_totals.last_date, 0)"
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_player_matches_totals_insert AFTER INSERT ON player_matches
+        BEGIN
+            INSERT INTO player_totals (player_id, {', '.join(COUNTERS)}, {', '.join(STREAKS)}, streak_dirty)
+            VALUES (NEW.player_id, {', '.join(new.values())},
+                    NEW.won, NEW.won, NEW.match_date, NEW.match_date, NEW.match_date IS NULL)
+            ON CONFLICT(player_id) DO UPDATE SET
+                {', '.join(f'{name} = {name} + excluded.{name}' for name in COUNTERS)},
+                current_streak = CASE WHEN NOT {in_order} THEN current_streak
+                                      WHEN excluded.won THEN current_streak + 1 ELSE 0 END,
+                longest_streak = CASE WHEN {in_order} AND excluded.won
+                                      THEN MAX(longest_streak, current_streak + 1) ELSE longest_streak END,
+                first_date = CASE WHEN first_date IS NULL OR excluded.first_date < first_date
+                                  THEN excluded.first_date ELSE first_date END,
+                last_date = CASE WHEN last_date IS NULL OR excluded.last_date > last_date
+                                 THEN excluded.last_date ELSE last_date END,
+                streak_dirty = CASE WHEN {in_order} THEN streak_dirty ELSE 1 END;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_player_matches_totals_delete AFTER DELETE ON player_matches
+        BEGIN
+            UPDATE player_totals SET
+                {', '.join(f'{name} = {name} - ({old[name]})' for name in COUNTERS)},
+                streak_dirty = 1
+             WHERE player_id = OLD.player_id;
+        END
+        ''',
+    ]
+
+
+def _streaks(won) -> tuple:
+    """(current, longest) run of wins in a date-ordered sequence of won flags."""
+    current = longest = 0
+    for w in won:
+        current = current + 1 if w else 0
+        longest = max(longest, current)
+    return current, longest
+
+
+# date order as compute_statistics sorts it (undated matches last), ties in insertion order
+_HISTORY = "SELECT won, match_date FROM player_matches WHERE player_id = ? ORDER BY match_date IS NULL, match_date, id"
+
+
+def _summary(rows) -> tuple:
+    """The STREAKS values of a player's date-ordered (won, match_date) rows."""
+    dates = [d for _, d in rows if d is not None]
+    return (*_streaks(w for w, _ in rows), min(dates, default=None), max(dates, default=None))
+
+
+def _recount(conn, player_id) -> tuple:
+    return _summary(conn.execute(_HISTORY, (player_id,)).fetchall())
+
+
+def settle(conn, player_ids=None) -> int:
+    """
+        Recounts the streaks and date range of streak_dirty players (of
+        `player_ids` only, if given) from their history. Runs inside the
+        caller's transaction; returns the number of players recounted.
+    """
+    ids = [pid for (pid,) in conn.execute("SELECT player_id FROM player_totals WHERE streak_dirty = 1")]
+    if player_ids is not None:
+        ids = sorted(set(ids) & set(player_ids))
+    for pid in ids:
+        conn.execute(f'''
+            UPDATE player_totals SET {', '.join(f'{name} = ?' for name in STREAKS)}, streak_dirty = 0
+             WHERE player_id = ?
+        ''', (*_recount(conn, pid), pid))
+    return len(ids)
+
+
+def _computed(conn) -> dict:
+    """player_id -> (counters..., streaks...) recomputed from player_matches in two scans."""
+    totals = {row[0]: row[1:] for row in conn.execute(f'''
+        SELECT player_id, {', '.join(f'SUM({expr})' for expr in counters('p').values())}
+          FROM player_matches p GROUP BY player_id
+    ''')}
+    history = {}
+    for pid, won, match_date in conn.execute(
+            "SELECT player_id, won, match_date FROM player_matches "
+            "ORDER BY player_id, match_date IS NULL, match_date, id"):
+        history.setdefault(pid, []).append((won, match_date))
+    for pid, rows in history.items():
+        totals[pid] = (*totals[pid], *_summary(rows))
+    return totals
+
+
+def rebuild(conn, check=False) -> dict:
+    """
+        Recomputes every player's totals from player_matches and reports the
+        players whose stored totals differ (streaks of streak_dirty rows are
+        not compared, those are recounted on read anyway). Unless `check`,
+        the table is then replaced by the recomputed totals.
+    """
+    started = time.perf_counter()
+    computed = _computed(conn)
+    stored = {row[0]: row[1:] for row in conn.execute(
+        f"SELECT player_id, {', '.join(COUNTERS + STREAKS)}, streak_dirty FROM player_totals WHERE matches > 0")}
+
+    def agrees(pid):
+        if pid not in computed or pid not in stored:
+            return False
+        *values, dirty = stored[pid]
+        n = len(COUNTERS) if dirty else len(values)
+        return tuple(values[:n]) == computed[pid][:n]
+
+    mismatched = sorted(pid for pid in computed.keys() | stored.keys() if not agrees(pid))
+    if not check:
+        with conn:
+            conn.execute("DELETE FROM player_totals")
+            columns = ('player_id',) + COUNTERS + STREAKS
+            conn.executemany(
+                f"INSERT INTO player_totals ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [(pid, *values) for pid, values in computed.items()],
+            )
+    return {'players': len(computed), 'mismatched': mismatched, 'seconds': time.perf_counter() - started}
+
+
+def _rate(num, den, empty=0.0):
+    return num / den if den else empty
+
+
+def headline(conn, player):
+    """
+        The headline metrics of a player's whole career, named as in
+        compute_statistics, from one player_totals row; None for a player
+        without matches. A streak_dirty row gets its streaks recounted here
+        without writing.
+    """
+    row = conn.execute(f'''
+        SELECT player_id, {', '.join(COUNTERS + STREAKS)}, streak_dirty FROM player_totals
+         WHERE player_id = (SELECT id FROM players WHERE name = ?)
+    ''', (player,)).fetchone()
+    if row is None or not row[1]:
+        return None
+    totals = dict(zip(COUNTERS + STREAKS, row[1:-1]))
+    if row[-1]:
+        totals.update(zip(STREAKS, _recount(conn, row[0])))
+    return derive(totals)
+
+
+def derive(totals) -> dict:
+    """Adds the compute_statistics metrics that follow from the COUNTERS in `totals`."""
+    totals['lost'] = totals['matches'] - totals['won']
+    totals['comeback_rate'] = _rate(totals['comebacks'], totals['first_sets_lost'])
+    totals['conversion_rate'] = _rate(totals['converted'], totals['first_sets_won'])
+    totals['set_win_pct'] = _rate(totals['sets_won'], totals['sets_played'])
+    totals['game_win_pct'] = _rate(totals['games_for'], totals['games_for'] + totals['games_against'])
+    totals['straight_vs_3_ratio'] = (totals['won'] - totals['won_3'], totals['won_3'])
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild and verify the incrementally kept player_totals.")
+    parser.add_argument("command", choices=["rebuild", "check"],
+                        help="check only reports players whose stored totals are off")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    db.init_schema(conn)
+    result = rebuild(conn, check=args.command == "check")
+    conn.close()
+    print(f"{result['players']} spelers nagerekend in {result['seconds']:.1f}s, "
+          f"{len(result['mismatched'])} met afwijkende totalen"
+          + (f": {result['mismatched'][:20]}" if result['mismatched'] else ''))
+    if args.command == "check" and result['mismatched']:
+        raise SystemExit(1)
@@ -0,0 +1,74 @@
+import argparse
+import time
+from datetime import date
+
+import numpy as np
+
+import db
+import player_totals
+
+DB_PATH = db.DB_PATH
+
+
+class PrefixIndex:
+    """
+        One player's matches as running totals of player_totals.COUNTERS in
+        date order: row k holds the counts over the first k dated matches.
+        The counts over any [start, end] window are then two binary searches
+        on the dates and one subtraction, however long the career. Streaks
+        and opponent-based metrics do not add up this way and are left to
+        stats_engine; undated matches are not in the index, as they are in
+        no date range.
+    """
+
+    def __init__(self, dates: np.ndarray, counts: np.ndarray):
+        self.dates = dates
+        self.cumulative = np.vstack([np.zeros((1, counts.shape[1]), dtype=counts.dtype),
+                                     np.cumsum(counts, axis=0)])
+
+    @classmethod
+    def load(cls, conn, player) -> 'PrefixIndex':
+        """Built from one ordered range read of the player's player_matches rows."""
+        rows = conn.execute(f'''
+            SELECT p.match_date, {', '.join(player_totals.counters('p').values())}
+              FROM player_matches p
+             WHERE p.player_id = (SELECT id FROM players WHERE name = ?) AND p.match_date IS NOT NULL
+             ORDER BY p.match_date, p.id
+        ''', (player,)).fetchall()
+        dates = np.array([str(r[0])[:10] for r in rows], dtype='datetime64[D]')
+        counts = np.array([r[1:] for r in rows], dtype='int64').reshape(len(rows), len(player_totals.COUNTERS))
+        return cls(dates, counts)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def totals(self, start=None, end=None) -> dict:
+        """player_totals.COUNTERS over the matches dated start..end (both inclusive, open when None)."""
+        lo = 0 if start is None else np.searchsorted(self.dates, np.datetime64(start, 'D'), side='left')
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')
+        window = self.cumulative[max(hi, lo)] - self.cumulative[lo]
+        return dict(zip(player_totals.COUNTERS, window.tolist()))
+
+    def statistics(self, start=None, end=None) -> dict:
+        """The additive compute_statistics metrics of the window, as player_totals.headline names them."""
+        return player_totals.derive(self.totals(start, end))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Date-range statistics from a player's prefix-sum index.")
+    parser.add_argument("player")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = db.connect(args.db)
+    started = time.perf_counter()
+    index = PrefixIndex.load(conn, args.player)
+    built = time.perf_counter()
+    stats = index.statistics(args.start, args.end)
+    queried = time.perf_counter()
+    conn.close()
+    for name, value in stats.items():
+        print(f"{name:20} {value:.3f}" if isinstance(value, float) else f"{name:20} {value}")
+    print(f"index van {len(index)} wedstrijden in {built - started:.3f}s, venster in {(queried - built) * 1e6:.0f}µs")
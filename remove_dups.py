@@ -1,28 +1,115 @@
-import sqlite3
-
-def remove_duplicates(db_path: str, table: str):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-
-    # 1) Create a temporary table of the unique rows by keeping the lowest ROWID per group
-    cur.execute(f"""
-        CREATE TEMPORARY TABLE keep AS
-        SELECT MIN(rowid) AS keep_id
-        FROM {table}
-        GROUP BY player1, player2, rating1, rating2
-    """)
-
-    # 2) Delete all rows whose rowid is NOT in the keep list
-    cur.execute(f"""
-        DELETE FROM {table}
-        WHERE rowid NOT IN (SELECT keep_id FROM keep)
-    """)
-
-    # 3) Drop the temp table and commit
-    cur.execute("DROP TABLE keep;")
-    conn.commit()
+import argparse
+import json
+import time
+
+import db
+import match_parser
+import player_totals
+
+DB_PATH = db.DB_PATH
+CHUNK_SIZE = 5000
+MATCH_COLUMNS = ('id, player1, rating1, player2, rating2, set1_p1, set1_p2, set2_p1, set2_p2, '
+                 'set3_p1, set3_p2, winner, match_date, match_key')
+
+
+def _games(value):
+    # older databases sometimes hold set scores as REAL
+    return None if value is None else int(value)
+
+
+def fingerprint(row) -> str:
+    """match_key of a stored row: the same key insertDB gives the match, whichever side it was scraped from."""
+    sets = [(_games(row['set1_p1']), _games(row['set1_p2'])),
+            (_games(row['set2_p1']), _games(row['set2_p2'])),
+            (_games(row['set3_p1']), _games(row['set3_p2']))]
+    return match_parser.match_key(row['player1'], row['player2'], sets, row['match_date'])
+
+
+def dedupe(conn, chunk_size=CHUNK_SIZE, recheck=False, verbose=True) -> dict:
+    """
+        Gives every row in `matches` its fingerprint and removes the rows whose
+        fingerprint an older row (lower id) already has. Walks the table in id
+        order, `chunk_size` rows per short transaction, so scrapers and the
+        dashboard keep working meanwhile; the last finished id is kept in
+        dedup_progress and an interrupted run carries on from there.
+
+        By default only rows without a match_key are looked at; `recheck`
+        recomputes the key of every row, e.g. after the key format changed.
+        Returns counts and the removed rows.
+    """
+    task = 'recheck' if recheck else 'missing'
+    row = conn.execute("SELECT last_id FROM dedup_progress WHERE task = ?", (task,)).fetchone()
+    last_id = row[0] if row else 0
+    total = conn.execute("SELECT MAX(id) FROM matches").fetchone()[0] or 0
+    only_missing = '' if recheck else 'AND match_key IS NULL'
+
+    scanned = 0
+    removed = []
+    started = time.perf_counter()
+    while True:
+        rows = conn.execute(f'''
+            SELECT {MATCH_COLUMNS} FROM matches
+             WHERE id > ? {only_missing}
+             ORDER BY id LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        names = MATCH_COLUMNS.split(', ')
+        with conn:
+            for values in rows:
+                row = dict(zip(names, values))
+                key = fingerprint(row)
+                if key == row['match_key']:
+                    continue
+                other = conn.execute("SELECT id FROM matches WHERE match_key = ?", (key,)).fetchone()
+                if other and other[0] < row['id']:
+                    conn.execute("DELETE FROM matches WHERE id = ?", (row['id'],))
+                    removed.append(dict(row, match_key=key, duplicate_of=other[0]))
+                    continue
+                if other:
+                    kept = dict(zip(names, conn.execute(
+                        f"SELECT {MATCH_COLUMNS} FROM matches WHERE id = ?", (other[0],)).fetchone()))
+                    conn.execute("DELETE FROM matches WHERE id = ?", (other[0],))
+                    removed.append(dict(kept, duplicate_of=row['id']))
+                conn.execute("UPDATE matches SET match_key = ? WHERE id = ?", (key, row['id']))
+            last_id = rows[-1][0]
+            conn.execute('''
+                INSERT INTO dedup_progress (task, last_id) VALUES (?, ?)
+                ON CONFLICT(task) DO UPDATE SET last_id = excluded.last_id
+            ''', (task, last_id))
+        scanned += len(rows)
+        if verbose:
+            print(f"tot id {last_id}/{total}: {scanned} rijen bekeken, {len(removed)} dubbel")
+
+    with conn:
+        conn.execute("DELETE FROM dedup_progress WHERE task = ?", (task,))
+    return {'scanned': scanned, 'removed': removed, 'seconds': time.perf_counter() - started}
+
+
+def remove_duplicates(db_path=DB_PATH, chunk_size=CHUNK_SIZE, recheck=False, report=None):
+    conn = db.connect(db_path)
+    db.init_schema(conn)
+    result = dedupe(conn, chunk_size, recheck)
+    with conn:
+        player_totals.settle(conn)
     conn.close()
-    print(f"Duplicates removed from `{table}` in `{db_path}`.")
+
+    if report and result['removed']:
+        with open(report, 'a', encoding='utf-8') as f:
+            for row in result['removed']:
+                f.write(json.dumps(row, default=str) + '\n')
+    print(f"{len(result['removed'])} dubbele wedstrijden verwijderd uit `{db_path}` "
+          f"({result['scanned']} rijen bekeken in {result['seconds']:.1f}s)")
+    return result
+
 
 if __name__ == "__main__":
-    remove_duplicates("matches.db", "matches")
+    parser = argparse.ArgumentParser(description="Remove duplicate matches by their canonical fingerprint.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--recheck", action="store_true",
+                        help="recompute the fingerprint of every row, not only of rows without one")
+    parser.add_argument("--report", help="append the removed rows to this JSON lines file")
+    args = parser.parse_args()
+
+    remove_duplicates(args.db, args.chunk_size, args.recheck, args.report)
@@ -0,0 +1,231 @@
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+import match_snapshot
+from batch_scrape import RateLimiter, run_pool
+from page_archive import PageArchive
+
+DB_PATH = db.DB_PATH
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 60          # seconds, doubled on every failed attempt
+REFRESH_EVERY = 24          # hours between two refreshes of the same player
+POLL_INTERVAL = 5           # seconds the daemon sleeps when there is nothing to do; the dashboard waits on it
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def enqueue(conn, member_nr) -> int:
+    """
+        Queues a scrape of one player, unless one is already queued or
+        running; returns the job id. Requests for the same player coalesce
+        into one job, also when several dashboard sessions ask at once.
+    """
+    member_nr = str(member_nr)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")     # the check and the insert under one write lock
+        row = conn.execute(
+            "SELECT id FROM scrape_jobs WHERE member_nr = ? AND status IN ('queued', 'running')", (member_nr,)
+        ).fetchone()
+        if row:
+            return row[0]
+        return conn.execute(
+            "INSERT INTO scrape_jobs (member_nr, created_at) VALUES (?, ?)", (member_nr, _now())
+        ).lastrowid
+
+
+def enqueue_refreshes(conn, every_hours=REFRESH_EVERY) -> int:
+    """Queues every known player whose last finished job is older than `every_hours`."""
+    cutoff = (datetime.now() - timedelta(hours=every_hours)).isoformat(timespec='seconds')
+    due = conn.execute('''
+        SELECT DISTINCT s.member_nr FROM scraped_seasons s
+         WHERE NOT EXISTS (SELECT 1 FROM scrape_jobs j
+                            WHERE j.member_nr = s.member_nr
+                              AND (j.status IN ('queued', 'running') OR j.finished_at > ?))
+    ''', (cutoff,)).fetchall()
+    for (member_nr,) in due:
+        enqueue(conn, member_nr)
+    return len(due)
+
+
+def recover(conn) -> int:
+    """Jobs that were running when the daemon stopped go back to the queue; they resume from their checkpoints."""
+    with conn:
+        return conn.execute("UPDATE scrape_jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+
+def claim(conn):
+    with conn:
+        row = conn.execute('''
+            SELECT id, member_nr FROM scrape_jobs
+             WHERE status = 'queued' AND run_after <= ?
+             ORDER BY run_after, id
+             LIMIT 1
+        ''', (time.time(),)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE scrape_jobs SET status = 'running', started_at = ? WHERE id = ?", (_now(), row[0]))
+    return row
+
+
+def finish(conn, job_id, player_name, error):
+    with conn:
+        if error is None:
+            conn.execute('''
+                UPDATE scrape_jobs SET status = 'done', finished_at = ?, player_name = ?, last_error = NULL
+                 WHERE id = ?
+            ''', (_now(), player_name, job_id))
+            return
+        attempts = conn.execute("SELECT attempts FROM scrape_jobs WHERE id = ?", (job_id,)).fetchone()[0] + 1
+        conn.execute('''
+            UPDATE scrape_jobs SET status = ?, attempts = ?, run_after = ?, last_error = ?, finished_at = ?
+             WHERE id = ?
+        ''', ('failed' if attempts >= MAX_ATTEMPTS else 'queued', attempts,
+              time.time() + RETRY_BACKOFF * 2 ** (attempts - 1), error,
+              _now() if attempts >= MAX_ATTEMPTS else None, job_id))
+
+
+def run_queued(conn, db_path=DB_PATH, pool_size=2, min_interval=0.0, archive=None, stop=None) -> int:
+    """
+        Works through the queued jobs with `pool_size` browsers. Scrapes are
+        incremental: scraped_seasons is the checkpoint written after every
+        season tab, so a retried or resumed job only opens what is missing.
+        Fetched pages also go to `archive` (a page_archive.PageArchive) if given.
+
+        Without `stop` the pool quits once the queue is empty. With a
+        threading.Event the pool stays up: idle workers keep their browser
+        and poll the queue every POLL_INTERVAL until `stop` is set. The
+        snapshot is refreshed whenever the queue runs dry. Returns the
+        number of jobs run.
+    """
+    lock = threading.Lock()
+    running = {}
+    counts = {'run': 0, 'since_refresh': 0}
+
+    def next_job():
+        while True:
+            with lock:
+                row = claim(conn)
+                if row is not None:
+                    job_id, member_nr = row
+                    running[member_nr] = job_id
+                    return member_nr
+                if counts['since_refresh'] and not running:
+                    match_snapshot.refresh_if_present(db_path)
+                    print(f"[{_now()}] {counts['since_refresh']} jobs gedraaid")
+                    counts['since_refresh'] = 0
+            if stop is None or stop.wait(POLL_INTERVAL):
+                return None
+
+    def report(member_nr, player_name, error):
+        with lock:
+            finish(conn, running.pop(member_nr), player_name, error)
+            counts['run'] += 1
+            counts['since_refresh'] += 1
+
+    if stop is None:
+        queued = conn.execute(
+            "SELECT COUNT(*) FROM scrape_jobs WHERE status = 'queued' AND run_after <= ?", (time.time(),)
+        ).fetchone()[0]
+        pool_size = min(pool_size, queued)
+    if pool_size:
+        run_pool(next_job, report, pool_size, db_path, incremental=True,
+                 archive=archive, limiter=RateLimiter(min_interval))
+    return counts['run']
+
+
+def daemon(db_path=DB_PATH, pool_size=2, min_interval=0.0, every_hours=REFRESH_EVERY, once=False, archive_dir=None):
+    archive = PageArchive(archive_dir) if archive_dir else None
+    conn = db.connect(db_path, check_same_thread=False)
+    db.init_schema(conn)
+    print(f"{recover(conn)} onderbroken jobs hervat")
+    if once:
+        added = enqueue_refreshes(conn, every_hours)
+        done = run_queued(conn, db_path, pool_size, min_interval, archive)
+        print(f"[{_now()}] {added} verversingen ingepland, {done} jobs gedraaid")
+        conn.close()
+        return
+
+    # one long-lived pool: browsers start and pass consent once, not on every poll;
+    # it has its own connection, this thread only queues the due refreshes
+    stop = threading.Event()
+    jobs_conn = db.connect(db_path, check_same_thread=False)
+    pool = threading.Thread(target=run_queued, args=(jobs_conn, db_path, pool_size, min_interval, archive, stop),
+                            daemon=True)
+    pool.start()
+    try:
+        while pool.is_alive():
+            added = enqueue_refreshes(conn, every_hours)
+            if added:
+                print(f"[{_now()}] {added} verversingen ingepland")
+            pool.join(POLL_INTERVAL)
+    finally:
+        stop.set()
+        pool.join()
+        jobs_conn.close()
+        conn.close()
+
+
+def progress(conn, job_id):
+    """
+        Where a job stands: its status plus the seasons stored for the player
+        since the job was queued and the matches on those pages, counted from
+        the scraped_seasons checkpoints the scrape writes per season tab.
+        `player_name` is known once the profile page is in. None for an
+        unknown job.
+    """
+    row = conn.execute('''
+        SELECT member_nr, status, attempts, created_at, started_at, finished_at, player_name, last_error
+          FROM scrape_jobs WHERE id = ?
+    ''', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(('member_nr', 'status', 'attempts', 'created_at', 'started_at', 'finished_at',
+                    'player_name', 'last_error'), row))
+    job['seasons'], job['matches'] = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(matches), 0) FROM scraped_seasons
+         WHERE member_nr = ? AND scraped_at >= ?
+    ''', (job['member_nr'], job['created_at'])).fetchone()
+    if job['player_name'] is None:
+        named = conn.execute("SELECT name FROM players WHERE member_nr = ?", (job['member_nr'],)).fetchone()
+        job['player_name'] = named[0] if named else None
+    return job
+
+
+def status(conn) -> dict:
+    return dict(conn.execute("SELECT status, COUNT(*) FROM scrape_jobs GROUP BY status").fetchall())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape job queue and refresh daemon.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="queue scrapes of member numbers")
+    add.add_argument("members", nargs="+")
+    run = sub.add_parser("run", help="run the scheduler daemon")
+    run.add_argument("--pool-size", type=int, default=2)
+    run.add_argument("--min-interval", type=float, default=0.0)
+    run.add_argument("--every-hours", type=float, default=REFRESH_EVERY)
+    run.add_argument("--once", action="store_true", help="run the queue once and exit")
+    run.add_argument("--archive", help="also store every fetched page in this page archive directory")
+    show = sub.add_parser("status", help="show job counts per status, or one job's progress")
+    show.add_argument("job", type=int, nargs="?")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        daemon(args.db, args.pool_size, args.min_interval, args.every_hours, args.once, args.archive)
+    else:
+        conn = db.connect(args.db)
+        db.init_schema(conn)
+        if args.command == "add":
+            for nr in args.members:
+                print(f"{nr}: job {enqueue(conn, nr)}")
+        elif args.job is not None:
+            print(progress(conn, args.job))
+        else:
+            print(status(conn))
+        conn.close()
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+METRICS_JSONL = 'scrape_metrics.jsonl'
+METRICS_PROM = 'scrape_metrics.prom'
+PREFIX = 'knltb_scrape'
+
+COUNTERS = ('pages_fetched', 'matches_parsed', 'duplicates_skipped', 'rows_inserted', 'wait_timeouts')
+
+
+class ScrapeMetrics:
+    """
+        Named timing spans and counters of one scrape run. Thread-safe, so the
+        workers of a batch can share one instance.
+    """
+
+    def __init__(self, run_id=None, **labels):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.labels = labels
+        self.started = time.time()
+        self.spans = {}      # name -> {'count', 'seconds', 'max'}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.gauges = {}     # name -> {'last', 'max'}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        """Adds a duration measured elsewhere (e.g. time spent in a queue) to a span."""
+        with self._lock:
+            s = self.spans.setdefault(name, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+            s['count'] += 1
+            s['seconds'] += seconds
+            s['max'] = max(s['max'], seconds)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self._lock:
+            g = self.gauges.setdefault(name, {'last': value, 'max': value})
+            g['last'] = value
+            g['max'] = max(g['max'], value)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'run_id': self.run_id,
+                'started_at': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'wall_seconds': round(time.time() - self.started, 3),
+                **self.labels,
+                'spans': {k: dict(v) for k, v in self.spans.items()},
+                'counters': dict(self.counters),
+                'gauges': {k: dict(v) for k, v in self.gauges.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        d = self.to_dict()
+        lines = [
+            f'# HELP {PREFIX}_span_seconds_total Time spent per scrape phase.',
+            f'# TYPE {PREFIX}_span_seconds_total counter',
+        ]
+        lines += [f'{PREFIX}_span_seconds_total{{span="{k}"}} {v["seconds"]:.6f}' for k, v in d['spans'].items()]
+        lines += [
+            f'# HELP {PREFIX}_span_count_total Number of times a scrape phase ran.',
+            f'# TYPE {PREFIX}_span_count_total counter',
+        ]
+        lines += [f'{PREFIX}_span_count_total{{span="{k}"}} {v["count"]}' for k, v in d['spans'].items()]
+        lines += [
+            f'# HELP {PREFIX}_span_max_seconds Slowest single run of a scrape phase.',
+            f'# TYPE {PREFIX}_span_max_seconds gauge',
+        ]
+        lines += [f'{PREFIX}_span_max_seconds{{span="{k}"}} {v["max"]:.6f}' for k, v in d['spans'].items()]
+        for name, value in d['counters'].items():
+            lines += [f'# TYPE {PREFIX}_{name}_total counter', f'{PREFIX}_{name}_total {value}']
+        for name, g in d['gauges'].items():
+            lines += [f'# TYPE {PREFIX}_{name} gauge', f'{PREFIX}_{name} {g["last"]}',
+                      f'# TYPE {PREFIX}_{name}_max gauge', f'{PREFIX}_{name}_max {g["max"]}']
+        lines += [f'# TYPE {PREFIX}_wall_seconds gauge', f'{PREFIX}_wall_seconds {d["wall_seconds"]}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, jsonl_path=METRICS_JSONL, prom_path=METRICS_PROM):
+        """Appends the run to the JSON lines log and replaces the Prometheus text file."""
+        if jsonl_path:
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.to_dict()) + '\n')
+        if prom_path:
+            tmp = Path(f'{prom_path}.tmp')
+            tmp.write_text(self.to_prometheus(), encoding='utf-8')
+            tmp.replace(prom_path)
+
+
+_local = threading.local()
+# collects what is measured outside of an activated run; never written anywhere
+_unused = ScrapeMetrics('unused')
+
+
+def activate(metrics):
+    """Makes `metrics` the instance span()/incr() record into on this thread."""
+    _local.metrics = metrics
+
+
+def current() -> ScrapeMetrics:
+    return getattr(_local, 'metrics', None) or _unused
+
+
+def span(name):
+    return current().span(name)
+
+
+def incr(name, n=1):
+    current().incr(name, n)
+
+
+def gauge(name, value):
+    current().gauge(name, value)
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+
+import db
+import player_rating_progression_scrape as scrape
+import scrape_metrics
+
+DB_PATH = db.DB_PATH
+_DONE = object()
+
+
+class PagePipeline:
+    """
+        Producer/consumer stages behind the browser:
+
+            browser --pages--> parse workers --parsed--> single SQLite writer
+
+        The browser only navigates and submit()s raw HTML; submit() blocks
+        when `queue_size` pages are waiting, so a slow parser or disk holds
+        the browser back instead of piling up memory. The writer stores
+        whatever parsed pages are waiting in one batch. Queue depths and the
+        time pages spend in each stage go into the shared ScrapeMetrics.
+        Errors are kept per member number; wait() tells a browser worker
+        whether all pages of its player made it into the database.
+    """
+
+    def __init__(self, db_path=DB_PATH, parse_workers=2, queue_size=4, batch_size=8, metrics=None):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.metrics = metrics or scrape_metrics.current()
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.parsed = queue.Queue(maxsize=queue_size * 2)
+        self.errors = {}            # member_nr -> first error one of its pages hit
+        self._pending = {}          # member_nr -> pages submitted but not yet stored or failed
+        self._settled = threading.Condition()
+        self._parsers = [threading.Thread(target=self._parse_loop, daemon=True) for _ in range(parse_workers)]
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        for t in self._parsers + [self._writer]:
+            t.start()
+
+    def submit(self, html, member_nr, player_name, season, complete):
+        with self._settled:
+            self._pending[str(member_nr)] = self._pending.get(str(member_nr), 0) + 1
+        self.pages.put((time.perf_counter(), html, member_nr, player_name, season, complete))
+        self.metrics.gauge('pipeline_pages_queued', self.pages.qsize())
+
+    def depths(self) -> dict:
+        return {'pages': self.pages.qsize(), 'parsed': self.parsed.qsize()}
+
+    def _settle(self, member_nr, error=None):
+        """One page of `member_nr` is stored, or failed with `error`."""
+        with self._settled:
+            self._pending[str(member_nr)] -= 1
+            if error is not None:
+                self.errors.setdefault(str(member_nr), error)
+            self._settled.notify_all()
+
+    def wait(self, member_nr):
+        """Blocks until every page submitted for `member_nr` is stored; returns the first error, or None."""
+        with self._settled:
+            self._settled.wait_for(lambda: not self._pending.get(str(member_nr)))
+            self._pending.pop(str(member_nr), None)
+            return self.errors.pop(str(member_nr), None)
+
+    def _parse_loop(self):
+        scrape_metrics.activate(self.metrics)
+        while True:
+            item = self.pages.get()
+            if item is _DONE:
+                break
+            queued_at, html, *season_info = item
+            self.metrics.observe('pipeline_page_wait', time.perf_counter() - queued_at)
+            try:
+                records = scrape.parseMatches(html)
+            except Exception as e:
+                self._settle(season_info[0], e)
+                print(f'Parsen mislukt voor {season_info[0]} {season_info[2]}: {e!r}')
+                continue
+            self.parsed.put((time.perf_counter(), records, *season_info))
+            self.metrics.gauge('pipeline_parsed_queued', self.parsed.qsize())
+
+    def _write_loop(self):
+        scrape_metrics.activate(self.metrics)
+        conn = db.connect(self.db_path)
+        c = conn.cursor()
+        finished = False
+        while not finished:
+            batch = [self.parsed.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.parsed.get_nowait())
+                except queue.Empty:
+                    break
+            if _DONE in batch:
+                finished = True
+                batch = [item for item in batch if item is not _DONE]
+            if not batch:
+                continue
+
+            now = time.perf_counter()
+            for queued_at, *_ in batch:
+                self.metrics.observe('pipeline_parsed_wait', now - queued_at)
+            error = None
+            try:
+                scrape.insertMatches([m for _, records, *_ in batch for m in records], c, conn)
+                for _, records, member_nr, player_name, season, complete in batch:
+                    scrape.recordSeason(records, member_nr, player_name, season, complete, c, conn)
+            except Exception as e:
+                conn.rollback()
+                error = e
+                print(f'Opslaan mislukt: {e!r}')
+            # the whole batch shares one outcome: every member with a page in it gets the error
+            for _, _, member_nr, *_ in batch:
+                self._settle(member_nr, error)
+            self.metrics.gauge('pipeline_write_batch', len(batch))
+        conn.close()
+
+    def close(self) -> dict:
+        """
+            Waits until every submitted page is stored and returns the errors
+            no wait() collected, as {member_nr: error}.
+        """
+        for _ in self._parsers:
+            self.pages.put(_DONE)
+        for t in self._parsers:
+            t.join()
+        self.parsed.put(_DONE)
+        self._writer.join()
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+
+# name -> (function, names of its inputs); inputs are other entries or 'df'
+_REGISTRY = {}
+# the public statistics, in the order compute_statistics has always returned them
+METRICS = []
+# returned by a metric that does not apply (no wins for best_beaten, ...); left out of the result
+MISSING = object()
+
+
+def _register(name, requires, public):
+    def wrap(fn):
+        _REGISTRY[name] = (fn, tuple(requires))
+        if public:
+            METRICS.append(name)
+        return fn
+    return wrap
+
+
+def column(name, *requires):
+    """Registers an intermediate array or mask other entries can require."""
+    return _register(name, requires, public=False)
+
+
+def metric(name, *requires):
+    """Registers a statistic callers can ask for by name."""
+    return _register(name, requires, public=True)
+
+
+class PlayerStats:
+    """
+        Lazily evaluated statistics of one player frame (analysis'
+        PLAYER_MATCHES columns). Asking for a metric computes only the
+        entries it depends on, and every entry is computed at most once per
+        frame, so several calls on the same PlayerStats share their masks.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._values = {'df': df}
+
+    def get(self, name):
+        if name not in self._values:
+            if name not in _REGISTRY:
+                raise KeyError(f"unknown metric {name!r}")
+            fn, requires = _REGISTRY[name]
+            self._values[name] = fn(*(self.get(r) for r in requires))
+        return self._values[name]
+
+    def compute(self, metrics=None) -> dict:
+        """`metrics` (default: all of METRICS) as a dict, without the ones that do not apply."""
+        values = {name: self.get(name) for name in (METRICS if metrics is None else metrics)}
+        return {name: value for name, value in values.items() if value is not MISSING}
+
+
+def compute(df: pd.DataFrame, metrics=None) -> dict:
+    return PlayerStats(df).compute(metrics)
+
+
+def _longest_run(flags: np.ndarray) -> int:
+    """Longest run of True values."""
+    runs = np.cumsum(flags)
+    # running total at the last False before each position
+    last_reset = np.maximum.accumulate(np.where(flags, 0, runs))
+    return int((runs - last_reset).max()) if len(flags) else 0
+
+
+def _rate(num, den):
+    return num / den if den else None
+
+
+# --- intermediates ---
+
+@column('n', 'df')
+def _n(df):
+    return len(df)
+
+
+@column('scores', 'df')
+def _scores(df):
+    """Set scores as one float array of shape (matches, 3 sets, 2 sides); NaN where a set was not played."""
+    cols = [f"set{i}_{side}" for i in (1, 2, 3) for side in ("floris", "opp")]
+    return df[cols].to_numpy(dtype="float64", na_value=np.nan).reshape(len(df), 3, 2)
+
+
+column('f', 'scores')(lambda scores: scores[:, :, 0])
+column('o', 'scores')(lambda scores: scores[:, :, 1])
+column('played', 'f', 'o')(lambda f, o: ~np.isnan(f) & ~np.isnan(o))
+column('set_won', 'f', 'o')(lambda f, o: f > o)
+column('set_lost', 'f', 'o')(lambda f, o: o > f)
+column('tiebreak', 'f', 'o')(lambda f, o: ((f == 7) & (o == 6)) | ((f == 6) & (o == 7)))
+column('won_mask', 'df')(lambda df: df["won"].to_numpy(dtype=bool))
+column('is_3set', 'df')(lambda df: df["is_3set"].to_numpy(dtype=bool))
+column('own_rating', 'df')(lambda df: df["floris_rating"].to_numpy())
+column('opp_rating', 'df')(lambda df: df["opp_rating"].to_numpy())
+column('rating_diff', 'own_rating', 'opp_rating')(lambda own, opp: own - opp)
+column('dropped1', 'set_lost')(lambda set_lost: set_lost[:, 0])
+column('won1', 'set_won')(lambda set_won: set_won[:, 0])
+column('beaten', 'won_mask')(lambda won: np.flatnonzero(won))
+column('lostto', 'won_mask')(lambda won: np.flatnonzero(~won))
+column('per_set_played', 'played')(lambda played: played.sum(axis=0))
+column('per_set_won', 'set_won', 'played')(lambda set_won, played: (set_won & played).sum(axis=0))
+
+
+def _count(own, opp):
+    """Sets with score own-opp, from the player's side."""
+    return lambda f, o: int(((f == own) & (o == opp)).sum())
+
+
+# --- metrics ---
+
+# 1) Matches won/lost
+metric('won', 'won_mask')(lambda won: won.sum())
+metric('lost', 'n', 'won')(lambda n, won: n - won)
+
+# 2) Won/lost in 3 sets
+metric('won_3', 'won_mask', 'is_3set')(lambda won, is_3set: int((won & is_3set).sum()))
+metric('lost_3', 'won_mask', 'is_3set')(lambda won, is_3set: int((~won & is_3set).sum()))
+
+
+# 3) Longest win-streak
+@metric('longest_streak', 'df', 'won_mask')
+def _longest_streak(df, won):
+    order = df["match_date"].reset_index(drop=True).sort_values().index.to_numpy()
+    return _longest_run(won[order])
+
+
+# 4) Tiebreaks won/lost
+metric('tb_won', 'set_won', 'tiebreak')(lambda set_won, tb: int((set_won & tb).sum()))
+metric('tb_lost', 'set_lost', 'tiebreak')(lambda set_lost, tb: int((set_lost & tb).sum()))
+
+# 5) Comeback rate (down 0–1 → win) and conversion rate (up 1–0 → win)
+metric('comebacks', 'won_mask', 'dropped1')(lambda won, dropped1: won[dropped1].sum())
+metric('comeback_rate', 'comebacks', 'dropped1')(
+    lambda comebacks, dropped1: comebacks / dropped1.sum() if dropped1.any() else 0.0)
+metric('converted', 'won_mask', 'won1')(lambda won, won1: won[won1].sum())
+metric('conversion_rate', 'converted', 'won1')(
+    lambda converted, won1: converted / won1.sum() if won1.any() else 0.0)
+
+
+# A) Set-win percentage
+@metric('set_win_pct', 'played', 'set_won')
+def _set_win_pct(played, set_won):
+    total_sets = int(played.sum())
+    sets_won = int((set_won & played).sum())
+    return sets_won / total_sets if total_sets else 0.0
+
+
+# B) Games-won percentage
+@metric('game_win_pct', 'f', 'o')
+def _game_win_pct(f, o):
+    gf, go = np.nansum(f), np.nansum(o)
+    return gf / (gf + go) if (gf + go) > 0 else 0.0
+
+
+# C) Performance vs higher-rated opponents
+@metric('upset_win_pct', 'won_mask', 'own_rating', 'opp_rating')
+def _upset_win_pct(won, own, opp):
+    upsets = opp < own
+    return won[upsets].sum() / upsets.sum() if upsets.any() else None
+
+
+@metric('favoured_win_pct', 'won_mask', 'own_rating', 'opp_rating')
+def _favoured_win_pct(won, own, opp):
+    favours = opp >= own
+    return won[favours].sum() / favours.sum() if favours.any() else None
+
+
+# D) Straight-sets vs 3-sets ratio (of wins)
+metric('straight_vs_3_ratio', 'won_mask', 'is_3set', 'won_3')(
+    lambda won, is_3set, won_3: (int((won & ~is_3set).sum()), won_3))
+
+# E) Close-set outcomes (7-5 / 5-7)
+metric('close_set_won', 'f', 'o')(_count(7, 5))
+metric('close_set_lost', 'f', 'o')(_count(5, 7))
+
+# F) Bagels (6-0) & Breadsticks (6-1)
+metric('bagels_won', 'f', 'o')(_count(6, 0))
+metric('bread_won', 'f', 'o')(_count(6, 1))
+metric('bagels_lost', 'f', 'o')(_count(0, 6))
+metric('bread_lost', 'f', 'o')(_count(1, 6))
+
+
+# G) Best/Worst & averages
+@metric('best_beaten', 'beaten', 'opp_rating', 'df')
+def _best_beaten(beaten, opp, df):
+    if not len(beaten):
+        return MISSING
+    best = beaten[np.nanargmin(opp[beaten])]
+    return {"opponent": df["opp_name"].iloc[best], "rating": opp[best]}
+
+
+metric('avg_rating_beaten', 'beaten', 'df')(
+    lambda beaten, df: df["opp_rating"].iloc[beaten].mean() if len(beaten) else MISSING)
+
+
+@metric('worst_lost_to', 'lostto', 'opp_rating', 'df')
+def _worst_lost_to(lostto, opp, df):
+    if not len(lostto):
+        return MISSING
+    worst = lostto[np.nanargmax(opp[lostto])]
+    return {"opponent": df["opp_name"].iloc[worst], "rating": opp[worst]}
+
+
+metric('avg_rating_lostto', 'lostto', 'df')(
+    lambda lostto, df: df["opp_rating"].iloc[lostto].mean() if len(lostto) else MISSING)
+
+for _i in (1, 2, 3):
+    metric(f'set{_i}_win_pct', 'per_set_won', 'per_set_played')(
+        lambda won, played, i=_i: _rate(won[i - 1], played[i - 1]))
+
+
+# Biggest upset win / worst upset loss
+def _biggest(rows, gap, df):
+    rows = rows[gap[rows] > 0]
+    if not len(rows):
+        return None
+    top = rows[np.argmax(gap[rows])]
+    return {"opponent": df["opp_name"].iloc[top], "rating_diff": gap[top]}
+
+
+metric('biggest_upset_win', 'beaten', 'rating_diff', 'df')(_biggest)
+metric('biggest_bad_beat_loss', 'lostto', 'rating_diff', 'df')(
+    lambda lostto, diff, df: _biggest(lostto, -diff, df))
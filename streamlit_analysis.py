@@ -1,216 +1,187 @@
+import functools
 import pandas as pd
 from datetime import datetime
 import sys
 import json
 from pathlib import Path
-import sqlite3
+import db
+from analysis import PLAYER_ID, PLAYER_MATCHES, compact
+import match_snapshot
+import player_totals
+from prefix_index import PrefixIndex
+import stats_engine
 import streamlit as st
 import plotly.graph_objs as go
 from datetime import date
-import player_rating_progression_scrape
-
-DB_PATH = 'matches.db'
-
-def enrich_dataframe(df: pd.DataFrame, player: str) -> pd.DataFrame:
-    df = df.copy()
-    df["is_p1"] = df["player1"] == player
-    # Floris’s rating
-    df["floris_rating"] = df.apply(lambda r: r["rating1"] if r["is_p1"] else r["rating2"], axis=1)
-    # Opponent name & rating
-    df["opp_name"]   = df.apply(lambda r: r["player2"] if r["is_p1"] else r["player1"], axis=1)
-    df["opp_rating"] = df.apply(lambda r: r["rating2"] if r["is_p1"] else r["rating1"], axis=1)
-    # Per-set scores
-    for i in (1,2,3):
-        df[f"set{i}_floris"] = df.apply(
-            lambda r: r[f"set{i}_p1"] if r["is_p1"] else r[f"set{i}_p2"], axis=1
-        )
-        df[f"set{i}_opp"] = df.apply(
-            lambda r: r[f"set{i}_p2"] if r["is_p1"] else r[f"set{i}_p1"], axis=1
-        )
-    # Win flag
-    df["won"] = df["winner"] == player
-    # 3-set flag
-    df["is_3set"] = df["set3_floris"].notna()
-    return df
-
-@st.cache_data
-def load_and_filter(player, start_date, end_date):
-    conn = sqlite3.connect('matches.db')
+import scheduler
+
+DB_PATH = db.DB_PATH
+
+CACHE_TTL = 600        # seconds a cached result may live, even if no scrape invalidated it
+CACHE_ENTRIES = 64     # results kept per cached function
+PROGRESS_POLL = 2      # seconds between two looks at a queued scrape
+
+
+@st.cache_resource
+def reader():
+    """One read-only connection for every session; the sqlite3 module is built thread-safe (serialized)."""
+    return db.connect(DB_PATH, check_same_thread=False)
+
+
+def data_version(conn) -> tuple:
+    """
+        A cheap token that changes exactly when a scraper commits: PRAGMA
+        data_version moves whenever another connection wrote, the newest
+        match and rating rowids on top of that survive restarts. Every
+        cached function below takes it as its last argument.
+    """
+    return (conn.execute("PRAGMA data_version").fetchone()[0],
+            conn.execute("SELECT MAX(id) FROM matches").fetchone()[0],
+            conn.execute("SELECT MAX(rowid) FROM current_ratings").fetchone()[0])
+
+
+@st.cache_resource
+def cache_counters() -> dict:
+    """function name -> calls and misses, shared by all sessions."""
+    return {}
+
+
+def _counted(cache, fn):
+    def count(what):
+        cache_counters().setdefault(fn.__name__, {'calls': 0, 'misses': 0})[what] += 1
+
+    @functools.wraps(fn)
+    def miss(*args):
+        count('misses')
+        return fn(*args)
+
+    store = cache(ttl=CACHE_TTL, max_entries=CACHE_ENTRIES, show_spinner=False)(miss)
+
+    @functools.wraps(fn)
+    def call(*args):
+        count('calls')
+        return store(*args)
+
+    call.clear = store.clear
+    return call
+
+
+def cached(fn):
+    """st.cache_data with TTL and size eviction, counting how often `fn` actually ran."""
+    return _counted(st.cache_data, fn)
+
+
+def shared(fn):
+    """As cached, but st.cache_resource: the result is handed out as is instead of copied per call."""
+    return _counted(st.cache_resource, fn)
+
+
+@cached
+def has_current(player, version):
+    row = reader().execute(f"SELECT 1 FROM current_ratings WHERE player_id = {PLAYER_ID}", {"player": player}).fetchone()
+    return row is not None
+
+
+@cached
+def load_and_filter(player, start_date, end_date, version):
+    conn = reader()
+    if match_snapshot.is_fresh(conn, DB_PATH):
+        return compact(match_snapshot.load_player_matches(DB_PATH, conn, player, start_date, end_date))
     df = pd.read_sql_query(
-        """
-        SELECT * FROM matches
-        WHERE (player1 = :p OR player2 = :p)
-          AND match_date BETWEEN :s AND :e
-        """,
+        f"{PLAYER_MATCHES} WHERE player_id = {PLAYER_ID} AND match_date BETWEEN :s AND :e ORDER BY match_date",
         conn,
-        params={"p": player, "s": start_date.strftime("%Y-%m-%d"), "e": end_date.strftime("%Y-%m-%d")},
-        parse_dates=["match_date"]
-    )
-    conn.close()
-    return enrich_dataframe(df, player)
-
-
-def compute_statistics(df: pd.DataFrame) -> dict:
-    stats = {}
-    n = len(df)
-
-    # 1) Matches won/lost
-    stats["won"] = df["won"].sum()
-    stats["lost"] = n - stats["won"]
-
-    # 2) Won/lost in 3 sets
-    stats["won_3"]  = df[df["won"]  & df["is_3set"]].shape[0]
-    stats["lost_3"] = df[~df["won"] & df["is_3set"]].shape[0]
-
-    # 3) Longest win-streak (unchanged)
-    def longest_streak(series):
-        max_s = cur = 0
-        for x in series:
-            cur = cur+1 if x else 0
-            max_s = max(max_s, cur)
-        return max_s
-    stats["longest_streak"] = longest_streak(df.sort_values("match_date")["won"])
-
-    # 4) Tiebreaks won/lost (unchanged)
-    tbw = tbl = 0
-    for i in (1,2,3):
-        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
-        tb = ((sf==7)&(so==6))|((sf==6)&(so==7))
-        tbw += int(((sf>so)& tb).sum())
-        tbl += int(((so>sf)& tb).sum())
-    stats["tb_won"], stats["tb_lost"] = tbw, tbl
-
-    # 5) Comeback rate (down 0–1 → win)
-    dropped1 = df[df["set1_floris"] < df["set1_opp"]]
-    stats["comebacks"] = dropped1["won"].sum()
-    stats["comeback_rate"] = (
-        stats["comebacks"] / len(dropped1)
-        if len(dropped1)>0 else 0.0
-    )
-    # conversion rate
-    won1 = df[df["set1_floris"] > df["set1_opp"]]
-    stats["converted"] = won1["won"].sum()
-    stats["conversion_rate"] = (
-        stats["converted"] / len(won1)
-        if len(won1) > 0 else 0.0
+        params={"player": player, "s": start_date.strftime("%Y-%m-%d"), "e": end_date.strftime("%Y-%m-%d")},
+        parse_dates=["match_date"],
+        dtype={"won": bool, "is_3set": bool}
     )
+    return compact(df)
+
 
-    # A) Set-win percentage
-    total_sets = 0
-    sets_won   = 0
-    for i in (1,2,3):
-        sf = df[f"set{i}_floris"]
-        so = df[f"set{i}_opp"]
-        played = sf.notna() & so.notna()
-        total_sets += int(played.sum())
-        sets_won   += int(((sf>so)& played).sum())
-    stats["set_win_pct"] = sets_won / total_sets if total_sets else 0.0
-
-    # B) Games-won percentage
-    gf = go = 0
-    for i in (1,2,3):
-        sf = df[f"set{i}_floris"].fillna(0)
-        so = df[f"set{i}_opp"].fillna(0)
-        gf += sf.sum()
-        go += so.sum()
-    stats["game_win_pct"] = gf / (gf+go) if (gf+go)>0 else 0.0
-
-    # C) Performance vs higher-rated opponents
-    upsets = df[df["opp_rating"] < df["floris_rating"]]
-    favours = df[df["opp_rating"] >= df["floris_rating"]]
-    stats["upset_win_pct"] = (
-        upsets["won"].sum() / len(upsets)
-        if len(upsets)>0 else None
+@cached
+def current_ratings(player, version):
+    cr = pd.read_sql_query(
+        f"SELECT date, rating FROM current_ratings WHERE player_id = {PLAYER_ID}",
+        reader(), params={"player": player}, parse_dates=["date"]
     )
-    stats["favoured_win_pct"] = (
-        favours["won"].sum() / len(favours)
-        if len(favours)>0 else None
+    cr.columns = ['date','rating']
+    return cr
+
+
+@shared
+def prefix_index(player, version):
+    """Built once per player and database version; every date range after that is a lookup."""
+    return PrefixIndex.load(reader(), player)
+
+
+@cached
+def statistics(player, start_date, end_date, metrics, version):
+    """stats_engine results for a tuple of metric names; each panel caches its own subset."""
+    return stats_engine.compute(load_and_filter(player, start_date, end_date, version), list(metrics))
+
+
+@cached
+def rating_figure(player, start_date, end_date, version):
+    # prepare time-series
+    hist = load_and_filter(player, start_date, end_date, version)[['match_date','floris_rating']].rename(
+        columns={'match_date':'date','floris_rating':'rating'}
     )
+    cr = current_ratings(player, version)
+    all_data = pd.concat([hist, cr], ignore_index=True).sort_values('date')
 
-    # D) Straight-sets vs 3-sets ratio (of wins)
-    wins = df[df["won"]]
-    straight = wins[~wins["is_3set"]].shape[0]
-    three    = wins[wins["is_3set"]].shape[0]
-    stats["straight_vs_3_ratio"] = (straight, three)
-
-    # E) Close-set outcomes (7-5 / 5-7)
-    csw = csl = 0
-    for i in (1,2,3):
-        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
-        mask75 = (sf==7)&(so==5)
-        mask57 = (sf==5)&(so==7)
-        csw += int(mask75.sum())
-        csl += int(mask57.sum())
-    stats["close_set_won"], stats["close_set_lost"] = csw, csl
-
-    # F) Bagels (6-0) & Breadsticks (6-1)
-    bagels_won = bread_won = bagels_lost = bread_lost = 0
-    for i in (1,2,3):
-        sf, so = df[f"set{i}_floris"], df[f"set{i}_opp"]
-        played = sf.notna() & so.notna()
-        bagels_won  += int(((sf==6)&(so==0)& played).sum())
-        bread_won   += int(((sf==6)&(so==1)& played).sum())
-        bagels_lost += int(((so==6)&(sf==0)& played).sum())
-        bread_lost  += int(((so==6)&(sf==1)& played).sum())
-    stats["bagels_won"]  = bagels_won
-    stats["bread_won"]   = bread_won
-    stats["bagels_lost"] = bagels_lost
-    stats["bread_lost"]  = bread_lost
-
-    # G) Best/Worst & averages (unchanged from before)
-    beaten = df[df["won"]]
-    lostto = df[~df["won"]]
-
-    if not beaten.empty:
-        bb_row = beaten.loc[beaten["opp_rating"].idxmin()]
-        stats["best_beaten"] = {
-            "opponent": bb_row["opp_name"],
-            "rating": bb_row["opp_rating"]
-        }
-        stats["avg_rating_beaten"] = beaten["opp_rating"].mean()
-
-    if not lostto.empty:
-        wl_row = lostto.loc[lostto["opp_rating"].idxmax()]
-        stats["worst_lost_to"] = {
-            "opponent": wl_row["opp_name"],
-            "rating": wl_row["opp_rating"]
-        }
-        stats["avg_rating_lostto"] = lostto["opp_rating"].mean()
-
-    for i in (1, 2, 3):
-        sf = df[f"set{i}_floris"]
-        so = df[f"set{i}_opp"]
-        played = sf.notna() & so.notna()
-        wins = ((sf > so) & played).sum()
-        total = played.sum()
-        stats[f"set{i}_win_pct"] = wins / total if total else None
-
-        # Biggest upset win
-    wins_df = df[df["won"]].copy()  # <-- copy() here
-    wins_df["rating_diff"] = wins_df["floris_rating"] - wins_df["opp_rating"]
-    upsets = wins_df[wins_df["rating_diff"] > 0]
-    if not upsets.empty:
-        uw = upsets.loc[upsets["rating_diff"].idxmax()]
-        stats["biggest_upset_win"] = {
-            "opponent": uw["opp_name"],
-            "rating_diff": uw["rating_diff"]
-        }
-    else:
-        stats["biggest_upset_win"] = None
-
-    # Biggest bad-beat loss
-    losses_df = df[~df["won"]].copy()  # <-- and copy() here
-    losses_df["rating_diff"] = losses_df["opp_rating"] - losses_df["floris_rating"]
-    bad_beats = losses_df[losses_df["rating_diff"] > 0]
-    if not bad_beats.empty:
-        bb = bad_beats.loc[bad_beats["rating_diff"].idxmax()]
-        stats["biggest_bad_beat_loss"] = {
-            "opponent": bb["opp_name"],
-            "rating_diff": bb["rating_diff"]
-        }
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=all_data['date'], y=all_data['rating'],
+        mode='lines+markers', line_shape='spline',
+        marker=dict(size=6), name='Rating'
+    ))
+    best_idx = all_data['rating'].idxmin()
+    fig.add_trace(go.Scatter(
+        x=[all_data.loc[best_idx,'date']],
+        y=[all_data.loc[best_idx,'rating']],
+        mode='markers+text',
+        text=[f"{all_data.loc[best_idx,'rating']:.2f}"],
+        textposition='bottom center',
+        marker=dict(size=12, color='red'),
+        showlegend=False
+    ))
+    fig.update_layout(
+        height=700,
+        margin=dict(l=60, r=40, t=60, b=60),
+        xaxis=dict(
+            type='date', tickformat='%Y-%m-%d',
+            dtick='M6', tickangle=-45
+        ),
+        yaxis=dict(title='Rating', autorange=True),
+        plot_bgcolor='#fafafa', paper_bgcolor='#ffffff'
+    )
+    return fig
+
+
+@st.fragment(run_every=PROGRESS_POLL)
+def scrape_progress(job_id):
+    """
+        Shows how far the worker got with a queued scrape. The whole report
+        reruns when new matches were stored, so partial results show up as
+        they arrive, and once more when the job is done.
+    """
+    job = scheduler.progress(reader(), job_id)
+    if job is None or job['status'] == 'done':
+        st.session_state.pop("scrape_job", None)
+        st.rerun()
+    if job['status'] == 'failed':
+        st.session_state.pop("scrape_job", None)
+        st.error(f"Scraping {job['member_nr']} failed after {job['attempts']} attempts: {job['last_error']}")
+        return
+    who = job['player_name'] or job['member_nr']
+    if job['status'] == 'queued' and job['last_error']:
+        st.warning(f"Attempt {job['attempts']} for {who} failed ({job['last_error']}), retrying soon…")
+    elif job['status'] == 'queued':
+        st.info(f"Scrape of {who} queued, waiting for the scrape worker (`python scheduler.py run`)…")
     else:
-        stats["biggest_bad_beat_loss"] = None
-    return stats
+        st.info(f"Scraping {who}: {job['seasons']} seasons, {job['matches']} matches stored so far…")
+    if job['matches'] > st.session_state.get("scrape_seen", 0):
+        st.session_state.scrape_seen = job['matches']
+        st.rerun()
 
 
 # — Streamlit App —
@@ -229,9 +200,13 @@ with st.form("report_form"):
     with col3:
         submitted = st.form_submit_button("Generate Report")
 
-if not submitted:
+if submitted:
+    st.session_state.report = (player, knltb_id, start, end)
+if "report" not in st.session_state:
     st.info("Fill out the form and click Generate Report.")
     st.stop()
+# progress reruns keep showing the last submitted report
+player, knltb_id, start, end = st.session_state.report
 
 # 2) On submit: ensure dates valid
 if start > end:
@@ -239,28 +214,57 @@ if start > end:
     st.stop()
 
 # 3) Check if we’ve scraped before
-conn = sqlite3.connect('matches.db')
-cur  = conn.cursor()
-cur.execute("SELECT 1 FROM current_ratings WHERE name = ?", (player,))
-has_current = cur.fetchone() is not None
-conn.close()
-
-# 4) If never scraped, require ID and run scraper
-if not has_current:
-    if not knltb_id.strip():
+conn = reader()
+version = data_version(conn)
+
+# 4) If never scraped, require ID and queue a scrape: the scheduler's worker
+#    drives the browser, this session only follows the job's progress.
+#    Only a submit queues a job; reruns just look at the last one.
+jobs = st.session_state.setdefault("scrape_jobs", {})    # (player, KNLTB id) -> last job queued for it
+request = (player, knltb_id.strip())
+if not has_current(player, version) and "scrape_job" not in st.session_state:
+    if not request[1]:
         st.error(f"No data for {player}. Please enter their KNLTB ID to scrape.")
         st.stop()
-    with st.spinner("Scraping historical data..."):
-        player_rating_progression_scrape.main(knltb_id)
-    st.success("Scraping complete!")
+    last = scheduler.progress(conn, jobs[request]) if request in jobs else None
+    if last and last['status'] == 'done':
+        found = f" The site lists member {request[1]} as {last['player_name']}." if last['player_name'] else ""
+        st.error(f"Scraped member {request[1]}, but there is no data for the name {player}.{found}")
+        st.stop()
+    if not submitted:
+        if last and last['status'] == 'failed':
+            st.error(f"Scraping {request[1]} failed: {last['last_error']}. Submit again to retry.")
+        st.stop()
+    writer = db.connect(DB_PATH)
+    st.session_state.scrape_job = jobs[request] = scheduler.enqueue(writer, request[1])
+    st.session_state.scrape_seen = 0
+    writer.close()
+if "scrape_job" in st.session_state:
+    scrape_progress(st.session_state.scrape_job)
 
 # 5) Load filtered data (may be empty if no matches in range)
-df = load_and_filter(player, start, end)
+df = load_and_filter(player, start, end, version)
+if df.empty and "scrape_job" in st.session_state:
+    st.stop()
 if df.empty:
     st.warning(f"No matches for {player} between {start} and {end}.")
 
-# 6) Compute stats & format text
-stats = compute_statistics(df)
+# 6) Compute stats & format text; each panel asks the engine for just its metrics
+KEY_METRICS = ("won", "lost", "won_3", "lost_3", "longest_streak", "tb_won", "tb_lost",
+               "comebacks", "comeback_rate", "converted", "conversion_rate")
+# a range covering the whole career reads the counting metrics from the running totals,
+# any other range from the player's prefix-sum index; the engine computes the rest.
+# The totals also count undated matches, which no date range holds: with any of those
+# (fewer matches in the index than in the totals) the index answers the career range too
+index = prefix_index(player, version)
+totals = player_totals.headline(conn, player)
+if (totals and totals['first_date'] and str(start) <= totals['first_date'] and str(end) >= totals['last_date']
+        and totals['matches'] == len(index)):
+    known = totals
+else:
+    known = index.statistics(start, end)
+stats = {name: known[name] for name in KEY_METRICS if name in known}
+stats.update(statistics(player, start, end, tuple(m for m in KEY_METRICS if m not in stats), version))
 
 # 7) Layout results in two columns
 col_left, col_right = st.columns([1, 2], gap="large")
@@ -298,6 +302,8 @@ with col_left:
                 col.metric(label, value)
 
     # All other metrics in a styled HTML block
+    stats.update((name, known[name]) for name in stats_engine.METRICS if name in known and name not in stats)
+    stats.update(statistics(player, start, end, tuple(m for m in stats_engine.METRICS if m not in stats), version))
     html = """
     <style>
       .stats-block p {{ margin:0.3em 0; }}
@@ -348,43 +354,9 @@ with col_left:
 
 with col_right:
     st.subheader("Rating Over Time")
-    # prepare time-series
-    hist = df[['match_date','floris_rating']].rename(
-        columns={'match_date':'date','floris_rating':'rating'}
-    )
-    conn = sqlite3.connect('matches.db')
-    cr   = pd.read_sql_query(
-        "SELECT date, rating FROM current_ratings WHERE name = ?",
-        conn, params=(player,), parse_dates=["date"]
-    )
-    conn.close()
-    cr.columns = ['date','rating']
-    all_data = pd.concat([hist, cr], ignore_index=True).sort_values('date')
+    fig = rating_figure(player, start, end, version)
+    st.plotly_chart(fig, use_container_width=True)
 
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=all_data['date'], y=all_data['rating'],
-        mode='lines+markers', line_shape='spline',
-        marker=dict(size=6), name='Rating'
-    ))
-    best_idx = all_data['rating'].idxmin()
-    fig.add_trace(go.Scatter(
-        x=[all_data.loc[best_idx,'date']],
-        y=[all_data.loc[best_idx,'rating']],
-        mode='markers+text',
-        text=[f"{all_data.loc[best_idx,'rating']:.2f}"],
-        textposition='bottom center',
-        marker=dict(size=12, color='red'),
-        showlegend=False
-    ))
-    fig.update_layout(
-        height=700,
-        margin=dict(l=60, r=40, t=60, b=60),
-        xaxis=dict(
-            type='date', tickformat='%Y-%m-%d',
-            dtick='M6', tickangle=-45
-        ),
-        yaxis=dict(title='Rating', autorange=True),
-        plot_bgcolor='#fafafa', paper_bgcolor='#ffffff'
-    )
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+with st.sidebar.expander("Cache"):
+    for name, counts in cache_counters().items():
+        st.write(f"{name}: {counts['calls'] - counts['misses']} hits, {counts['misses']} misses")